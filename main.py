@@ -2,15 +2,39 @@
 import sys
 import os
 import json
+import asyncio
 import argparse
+import atexit
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
+try:
+    import orjson  # C JSON codec, ~5x faster on the big info["steps"] blobs
+except ImportError:
+    orjson = None
+
+
+def _json_dumps_line(record):
+    """One JSONL line as bytes: orjson appends the newline in C and the
+    result goes straight to the binary checkpoint handle with no
+    decode/encode round-trip."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+        except TypeError:
+            pass  # orjson refuses some types (e.g. numpy scalars pre-3.x configs)
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _json_loads(line):
+    return orjson.loads(line) if orjson is not None else json.loads(line)
+
 os.makedirs("outputs", exist_ok=True)
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
 # from tot.methods.bfs import solve
-from tot.tasks import get_task
-from tot.methods import get_method
 from tot.methods.evaluate_utils import evaluate
 
 
@@ -26,6 +50,206 @@ def _extract_final_output(res):
         return res[-1]
     return res
 
+
+def _ckpt_path(args):
+    # === Checkpoint ===
+    # Remove special characters from the model name (to prevent invalid filenames).
+    safe_backend = args.backend.replace(":", "_").replace("/", "_")
+    if args.method == "dtree":
+        ckpt_name = f"llm_dtree_{safe_backend}_{'with_text' if args.use_text else 'no_text'}_predictions.json"
+    else:
+        ckpt_name = f"llm_{args.method}_{safe_backend}_{'with_text' if args.use_text else 'no_text'}_predictions.json"
+    return os.path.join(os.path.dirname(__file__), "outputs", ckpt_name)
+
+
+def _load_checkpoint(ckpt_path):
+    """
+    JSONL checkpoint loader. Fast path parses the whole file in C via
+    `pandas.read_json(..., lines=True)`; if the file contains corrupted
+    lines we fall back to the tolerant line-by-line parser.
+    Returns the list of result records (possibly empty).
+    """
+    if not (os.path.exists(ckpt_path) and os.path.getsize(ckpt_path) > 0):
+        return []
+
+    try:
+        import pandas as pd
+        df = pd.read_json(ckpt_path, lines=True)
+        return df.to_dict(orient="records")
+    except ValueError:
+        print("[Warning] Vectorized checkpoint parse failed, falling back to line-by-line.")
+
+    all_results = []
+    with open(ckpt_path, "r", encoding="utf-8") as f:
+        for line in f:
+        # Ignore blank lines in the file
+            if line.strip():
+                try:
+                    all_results.append(_json_loads(line))
+                except ValueError:
+                    print(f"Warning: Unresolved line found, skipped.: {line.strip()}")
+    return all_results
+
+
+async def _run_pending(args, task, method, pending):
+    """
+    Async driver: keep up to args.concurrency requests in flight so the backend
+    can overlap prefill/decode across patients (continuous batching), and yield
+    results in completion order so the checkpoint streams as they finish.
+    """
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def run_one(i):
+        async with sem:
+            # method.solve is blocking (HTTP to the backend), so run it in a
+            # worker thread to keep the event loop free.
+            res, info = await asyncio.to_thread(method.solve, args, task, i, False)
+        return i, res, info
+
+    coros = [run_one(i) for i in pending]
+    for fut in asyncio.as_completed(coros):
+        yield await fut
+
+
+def run_shard(shard_id, n_shards, args):
+    """
+    Process every pending patient i with i % n_shards == shard_id (offset by
+    args.start) and append results to this shard's own checkpoint file.
+
+    Patients are independent, so sharding is embarrassingly parallel: each
+    worker owns one GPU / backend replica and throughput scales with shards.
+    """
+    # Pin the GPU before any CUDA-aware import; only matters when the backend
+    # runs in-process (harmless when talking to an HTTP server).
+    if n_shards > 1:
+        os.environ.setdefault("CUDA_VISIBLE_DEVICES", str(shard_id))
+
+    from tot.tasks import get_task
+    from tot.methods import get_method
+
+    task = get_task(args.task, use_text=args.use_text)
+    # get_input re-walks the patient's lab sessions on every call, and both
+    # method.solve and the checkpoint record need it — memoize per index.
+    task.get_input = functools.lru_cache(maxsize=1024)(task.get_input)
+
+    method = get_method(args.method)
+
+    end = args.end if args.end is not None else len(task)
+
+    ckpt_path = _ckpt_path(args)
+    if n_shards > 1:
+        ckpt_path += f".shard{shard_id}"
+
+    # Only the processed ids are needed for resume; records stream straight to
+    # disk so memory stays O(1) per patient even with huge info["steps"].
+    # Valid-JSON lines without an example_id (corrupted checkpoint) are
+    # ignored rather than crashing the resume.
+    done_ids = {r["example_id"] for r in _load_checkpoint(ckpt_path)
+                if r.get("example_id") is not None}
+    if done_ids:
+        print(f"[Checkpoint loaded] {len(done_ids)} examples already processed.")
+    else:
+        print("[Checkpoint] Starting from scratch.")
+
+    # Async loop: keep a bounded window of requests in flight and stream
+    # results into the checkpoint in completion order (checkpoint semantics
+    # are preserved because resume keys on example_id, not file order).
+    pending = [i for i in range(args.start + shard_id, min(end, len(task)), n_shards)
+               if i not in done_ids]
+
+    # Open the checkpoint once for the whole run instead of open/close per
+    # record; the OS page cache coalesces the buffered writes, and we fsync
+    # every FLUSH_EVERY records to bound data loss on a crash.
+    FLUSH_EVERY = 16
+    ckpt_f = open(ckpt_path, "ab", buffering=1 << 20)
+
+    # Single background writer: JSON encoding + disk write overlap the next
+    # LLM call instead of sitting between dispatches. max_workers=1 keeps the
+    # writes serialized, so no extra locking is needed around ckpt_f.
+    writer = ThreadPoolExecutor(max_workers=1)
+    written_count = [0]
+    # First exception raised inside the background writer; checked after each
+    # submit and again at shutdown so a failed write (disk full, I/O error,
+    # unserializable record) aborts the run instead of silently dropping
+    # checkpoint records.
+    write_error = []
+
+    def _write_record(record):
+        ckpt_f.write(_json_dumps_line(record))
+        written_count[0] += 1
+        if written_count[0] % FLUSH_EVERY == 0:
+            ckpt_f.flush()
+            os.fsync(ckpt_f.fileno())
+
+    def _note_write_error(fut):
+        exc = fut.exception()
+        if exc is not None and not write_error:
+            write_error.append(exc)
+
+    atexit.register(lambda: (writer.shutdown(wait=True), ckpt_f.close()))
+
+    async def _drive():
+        with tqdm(total=len(pending), desc=f"Processing patients (shard {shard_id})") as pbar:
+            async for i, res, info in _run_pending(args, task, method, pending):
+                subject_id = task.subject_ids[i]
+                print(f"\n[Patient #{i} | Subject ID: {subject_id}]")
+
+                x = task.get_input(i)
+
+                # Pure functions of the same inputs — compute once and reuse.
+                final_output = _extract_final_output(res)
+                formatted = task.format_output(final_output)
+                correct = task.test_output(i, final_output)
+                gold = task.get_answer(i)
+
+                print(f"\nFinal Output:\n{final_output}")
+                print("Correct?", correct)
+
+                #save checkpoints
+                tmp_results = []
+
+                tmp_results.append({
+                    "example_id": i,
+                    "subject_id": subject_id,
+                    "input": x,
+                    "final_output": final_output,
+                    "steps": info.get("steps", []),
+                    "correct": correct,
+                    "y_pred": formatted,
+                    "y_true": gold
+                })
+
+                writer.submit(_write_record, tmp_results[0]).add_done_callback(_note_write_error)
+                if write_error:
+                    raise write_error[0]
+                pbar.update(1)
+
+    asyncio.run(_drive())
+    writer.shutdown(wait=True)
+    if write_error:
+        raise write_error[0]
+    ckpt_f.close()
+    return ckpt_path
+
+
+def _merge_shards(ckpt_path, n_shards):
+    """
+    Concatenate per-shard JSONL files into the canonical checkpoint,
+    deduplicating on example_id (the canonical file may already contain
+    results from earlier single-shard runs).
+    """
+    seen = {r["example_id"] for r in _load_checkpoint(ckpt_path)
+            if r.get("example_id") is not None}
+    with open(ckpt_path, "ab", buffering=1 << 20) as out:
+        for shard_id in range(n_shards):
+            shard_path = f"{ckpt_path}.shard{shard_id}"
+            for r in _load_checkpoint(shard_path):
+                example_id = r.get("example_id")
+                if example_id is not None and example_id not in seen:
+                    seen.add(example_id)
+                    out.write(_json_dumps_line(r))
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--task', type=str, default='thyroid_lab')
@@ -51,100 +275,34 @@ def main():
     parser.add_argument('--n_generate_cot', type=int, default=5,
                         help='When --method cot, number of self-consistency samples')
 
+    # Micro-batch size for batched inference (vLLM continuous batching packs the chunk)
+    parser.add_argument('--batch_size', type=int, default=32,
+                        help='Number of patients dispatched to the backend per batch')
+    parser.add_argument('--concurrency', type=int, default=64,
+                        help='Max in-flight requests to the backend')
+    parser.add_argument('--n_shards', type=int, default=1,
+                        help='Data-parallel worker processes (one GPU/backend replica each)')
+
     args = parser.parse_args()
     # args.use_text = True    # Force enable text_summary
 
-    task = get_task(args.task, use_text=args.use_text)
-
-    method = get_method(args.method)
-
-    if args.end is None:
-        args.end = len(task)
-
-    # print(task.get_flag_input(1))
-    # return 0
-
-    # === Checkpoint ===
-    # Remove special characters from the model name (to prevent invalid filenames).
+    ckpt_path = _ckpt_path(args)
     safe_backend = args.backend.replace(":", "_").replace("/", "_")
-    if args.method == "dtree":
-        ckpt_name = f"llm_dtree_{safe_backend}_{'with_text' if args.use_text else 'no_text'}_predictions.json"
-    else:
-        ckpt_name = f"llm_{args.method}_{safe_backend}_{'with_text' if args.use_text else 'no_text'}_predictions.json"
-    ckpt_path = os.path.join(os.path.dirname(__file__), "outputs", ckpt_name)
 
-    y_true = []
-    y_pred = []
-
-    if os.path.exists(ckpt_path) and os.path.getsize(ckpt_path) > 0:
-        try:
-            all_results = []
-            with open(ckpt_path, "r", encoding="utf-8") as f:
-                for line in f:
-                # Ignore blank lines in the file
-                    if line.strip():
-                        try:
-                            all_results.append(json.loads(line))
-                        except json.JSONDecodeError:
-                            print(f"Warning: Unresolved line found, skipped.: {line.strip()}")
-                # all_results = json.load(f)
-            done_ids = {r["example_id"] for r in all_results}
-            y_true = [r["y_true"] for r in all_results]
-            y_pred = [r["y_pred"] for r in all_results]
-            print(f"[Checkpoint loaded] {len(all_results)} examples already processed.")
-        except (json.JSONDecodeError, KeyError) as e:
-            print(f"[Warning] Checkpoint file is corrupted: {e}. Starting from scratch.")
-            all_results = []
-            done_ids = set()
+    if args.n_shards <= 1:
+        run_shard(0, 1, args)
     else:
-        all_results = []
-        done_ids = set()
-        print("[Checkpoint] Starting from scratch.")
-
-
-    # 替换原来的 for 循环部分
-    for i in tqdm(range(args.start, min(args.end, len(task))), desc="Processing patients"):
-        if i in done_ids:
-            continue
-        subject_id = task.subject_ids[i]
-        print(f"\n[Patient #{i} | Subject ID: {subject_id}]")
-
-        x = task.get_input(i)
-        print(f"\nInput:\n{x}\n")
-
-        # Unified Invocation
-        res, info = method.solve(args, task, i, True)
-
-        final_output = _extract_final_output(res)
-        print(f"\nFinal Output:\n{final_output}")
-        print("Correct?", task.test_output(i, final_output))
-
-        final_output = _extract_final_output(res)
-        y_true.append(task.get_answer(i))
-        y_pred.append(task.format_output(final_output))
-
-        #save checkpoints
-        tmp_results = []
-
-        tmp_results.append({
-            "example_id": i,
-            "subject_id": subject_id,
-            "input": x,
-            "final_output": final_output,
-            "steps": info.get("steps", []),
-            "correct": task.test_output(i, final_output),
-            "y_pred": task.format_output(final_output),
-            "y_true": task.get_answer(i)
-        })
-        all_results.append(tmp_results[0])
-
-        with open(ckpt_path, "a", encoding="utf-8") as f:
-            f.write(json.dumps(tmp_results[0], ensure_ascii=False) + '\n')
-            # json.dump(tmp_results, f, ensure_ascii=False, indent=2)
+        # spawn (not fork): workers must pin CUDA_VISIBLE_DEVICES before any
+        # CUDA-aware import happens in their interpreter.
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(args.n_shards) as pool:
+            pool.starmap(run_shard, [(s, args.n_shards, args) for s in range(args.n_shards)])
+        _merge_shards(ckpt_path, args.n_shards)
 
     print("\n=== Overall Evaluation ===")
-    y_true = [int(label) for label in y_true]
-    y_pred = [int(label) for label in y_pred]
+    all_results = _load_checkpoint(ckpt_path)
+    y_true = [int(r["y_true"]) for r in all_results]
+    y_pred = [int(r["y_pred"]) for r in all_results]
     evaluate(
         y_true,
         y_pred,
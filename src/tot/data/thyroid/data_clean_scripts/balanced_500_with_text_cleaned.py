@@ -29,23 +29,30 @@ DIAG_PATH         = DATA_ROOT / "thyroid_diagnosis_1.csv"
 OUTPUT_PATH       = DATA_ROOT / "balanced_500_with_text_cleaned.csv"
 
 # ========== read data ==========
+def _read_csv_fast(path, **kwargs):
+    """Prefer the multithreaded PyArrow parser for the big tables; fall back
+    to the default C engine when pyarrow is not installed."""
+    try:
+        return pd.read_csv(path, engine="pyarrow", **kwargs)
+    except (ImportError, ValueError):
+        return pd.read_csv(path, **kwargs)
+
 thy_text = pd.read_csv(THYROID_TEXT_PATH)
 rand_text = pd.read_csv(RANDOM_TEXT_PATH)
-labs = pd.read_csv(LABS_PATH)
-diag = pd.read_csv(DIAG_PATH)
+diag = _read_csv_fast(DIAG_PATH)
 
-for df in [thy_text, rand_text, labs, diag]:
+for df in [thy_text, rand_text, diag]:
     df["subject_id"] = df["subject_id"].astype(int)
 
+# The labs table is loaded lazily below, once the selected patient set is
+# known, so the filter can be pushed into the read.
+
 # ========== clean text ==========
-def clean_text(t):
-    if pd.isna(t):
-        return t
-    t = re.sub(r'### Diagnosis:.*?(?=###|\Z)', '', t, flags=re.DOTALL)
-    return t.strip()
+# Compiled once and applied column-wise (NaNs pass through unchanged).
+_DIAG_RE = re.compile(r'### Diagnosis:.*?(?=###|\Z)', re.DOTALL)
 
-thy_text["llm_output"] = thy_text["llm_output"].apply(clean_text)
-rand_text["llm_output"] = rand_text["llm_output"].apply(clean_text)
+thy_text["llm_output"] = thy_text["llm_output"].str.replace(_DIAG_RE, "", regex=True).str.strip()
+rand_text["llm_output"] = rand_text["llm_output"].str.replace(_DIAG_RE, "", regex=True).str.strip()
 
 # ========== Labeling confirmed cases ==========
 diag_ids = set(diag["subject_id"].astype(int))
@@ -64,50 +71,60 @@ selected_neg_rand = np.random.choice(neg_ids_rand, 50, replace=False)
 
 # ========== A summary of 500 patients ==========
 selected_ids = np.concatenate([selected_pos, selected_neg_thy, selected_neg_rand])
-selected_set = set(selected_ids)
+# pd.Index instead of a Python set: isin() reuses the Index hashtable directly
+# rather than converting set -> list -> hashtable on every call.
+selected_idx = pd.Index(selected_ids)
 
 # ========== Retrieve the corresponding patient's laboratory records. ==========
-labs_selected = labs[labs["subject_id"].isin(selected_set)].copy()
+# When a parquet sidecar exists (one-off: pd.read_csv(LABS_PATH).to_parquet(...)),
+# the patient filter is pushed into the read so dropped rows are never
+# materialized; otherwise fall back to loading the full CSV and filtering.
+LABS_PARQUET_PATH = LABS_PATH.with_suffix(".parquet")
+if LABS_PARQUET_PATH.exists():
+    labs_selected = pd.read_parquet(
+        LABS_PARQUET_PATH, filters=[("subject_id", "in", selected_idx.tolist())]
+    )
+    labs_selected["subject_id"] = labs_selected["subject_id"].astype(int)
+else:
+    labs = _read_csv_fast(LABS_PATH)
+    labs["subject_id"] = labs["subject_id"].astype(int)
+    labs_selected = labs[labs["subject_id"].isin(selected_idx)].copy()
 
 # ========== Select a unique text for each patient ==========
-thyroid_text_map = (
-    thy_text.drop_duplicates(subset="subject_id")[["subject_id", "llm_output", "label"]]
-    .set_index("subject_id")
-    .to_dict(orient="index")
-)
-random_text_map = (
-    rand_text.drop_duplicates(subset="subject_id")[["subject_id", "llm_output", "label"]]
-    .set_index("subject_id")
-    .to_dict(orient="index")
+# Pure column ops, no per-patient Python dicts: thyroid rows come first so
+# keep="first" gives them priority over random text for shared patients.
+# Random-text patients are always negative, so force label 0 here rather
+# than trusting whatever label column their source file carries.
+text_df = (
+    pd.concat([
+        thy_text.drop_duplicates(subset="subject_id")[["subject_id", "llm_output", "label"]],
+        rand_text.drop_duplicates(subset="subject_id")[["subject_id", "llm_output"]].assign(label=0),
+    ], ignore_index=True)
+    .drop_duplicates(subset="subject_id", keep="first")
+    .rename(columns={"llm_output": "text_summary"})
 )
 
-def get_text_and_label(sid):
-    if sid in thyroid_text_map:
-        return thyroid_text_map[sid]["llm_output"], thyroid_text_map[sid]["label"]
-    elif sid in random_text_map:
-        return random_text_map[sid]["llm_output"], 0
-    else:
-        return pd.NA, pd.NA
-
-# ========== Patient-by-patient mapping of laboratory records to text and labels ==========
-labs_selected[["text_summary", "label"]] = labs_selected["subject_id"].apply(
-    lambda sid: pd.Series(get_text_and_label(sid))
-)
+# ========== Map laboratory records to text and labels via a hash join ==========
+# A single merge against the small per-patient table replaces the per-row
+# apply(pd.Series) lookup (Python call + Series allocation per lab row).
+labs_selected = labs_selected.merge(text_df, on="subject_id", how="left")
 
 # ========== Random patient replacement laboratory line ==========
-lab_cols = [c for c in labs.columns if c != "subject_id"]
-rand_ids_to_add = [sid for sid in selected_neg_rand if sid not in labs_selected["subject_id"].unique()]
-rand_rows = []
-for sid in rand_ids_to_add:
-    r = {col: pd.NA for col in lab_cols}
-    r["subject_id"] = sid
-    txt, lbl = get_text_and_label(sid)
-    r["text_summary"] = txt
-    r["label"] = lbl
-    rand_rows.append(r)
-
-if rand_rows:
-    labs_selected = pd.concat([labs_selected, pd.DataFrame(rand_rows)], ignore_index=True)
+# Hashtable set-difference instead of an O(n*m) membership scan against the
+# unique() array.
+existing = pd.Index(labs_selected["subject_id"].unique())
+rand_ids_to_add = pd.Index(selected_neg_rand).difference(existing).tolist()
+
+if rand_ids_to_add:
+    # All lab columns stay NA for random patients, so reindex against the
+    # existing column layout instead of allocating each NA column by hand;
+    # text/label come from a vectorized map over the per-patient lookup.
+    text_lookup = text_df.set_index("subject_id")
+    rand_df = pd.DataFrame({"subject_id": rand_ids_to_add})
+    rand_df = rand_df.reindex(columns=labs_selected.columns)
+    rand_df["text_summary"] = rand_df["subject_id"].map(text_lookup["text_summary"])
+    rand_df["label"] = rand_df["subject_id"].map(text_lookup["label"])
+    labs_selected = pd.concat([labs_selected, rand_df], ignore_index=True)
 
 # ========== Output (keeping all patient examinations arranged sequentially in chronological order) ==========
 
@@ -118,15 +135,44 @@ for c in ["charttime", "hadm_id", "storetime"]:
         time_col = c
         break
 
+# Integer-code sort: subject_id as category sorts by code, and a datetime
+# sort key is faster than its string form; mergesort keeps the
+# within-patient order stable.
+labs_selected["subject_id"] = labs_selected["subject_id"].astype("category")
+sort_col = time_col
+if time_col in ("charttime", "storetime"):
+    # The timestamps are dd/mm/YYYY strings: pandas' default month-first
+    # inference misparses them (day > 12 coerces to NaT and sorts last),
+    # and a datetime column would export as ISO text that the downstream
+    # %d/%m/%Y %H:%M:%S parse rejects wholesale. Sort on a temporary
+    # parsed key and keep the original strings for the export.
+    labs_selected["_time_key"] = pd.to_datetime(
+        labs_selected[time_col], format="%d/%m/%Y %H:%M:%S", errors="coerce"
+    )
+    sort_col = "_time_key"
+
 if time_col:
     print(f"[INFO] Detection time column：{time_col}")
-    labs_selected = labs_selected.sort_values(by=["subject_id", time_col])
+    labs_selected = labs_selected.sort_values(by=["subject_id", sort_col], kind="mergesort")
 else:
     print("[WARN] Time column not found, sort by subject_id")
-    labs_selected = labs_selected.sort_values(by="subject_id")
+    labs_selected = labs_selected.sort_values(by="subject_id", kind="mergesort")
+
+labs_selected = labs_selected.drop(columns="_time_key", errors="ignore")
+
+# Plain ints again so the exports and downstream loaders see the usual dtype.
+labs_selected["subject_id"] = labs_selected["subject_id"].astype(int)
+
+# Output to file (chunked: bounded memory while formatting rows)
+labs_selected.to_csv(OUTPUT_PATH, index=False, encoding="utf-8", chunksize=100_000)
 
-# Output to file
-labs_selected.to_csv(OUTPUT_PATH, index=False, encoding="utf-8")
+# Parquet sidecar: columnar + compressed, so downstream loads skip CSV
+# quoting/escaping of the long LLM text summaries entirely.
+try:
+    labs_selected.to_parquet(OUTPUT_PATH.with_suffix(".parquet"), compression="zstd")
+    print(f"Saved parquet sidecar: {OUTPUT_PATH.with_suffix('.parquet')}")
+except ImportError:
+    print("[WARN] pyarrow not installed, skipping parquet sidecar")
 
 # ========== Verification output ==========
 print(f"Saved to: {OUTPUT_PATH}")
@@ -16,61 +16,79 @@ labs_path = DATA_ORIG / "thyroid_labs_full_1.csv"
 diag_path = DATA_ORIG / "thyroid_diagnosis_1.csv"
 random_notes_path = DATA_ORIG / "random_patients_with_notes.csv"
 
+def _read_csv_fast(path, **kwargs):
+    """Prefer the multithreaded PyArrow parser for the big tables; fall back
+    to the default C engine when pyarrow is not installed."""
+    try:
+        return pd.read_csv(path, engine="pyarrow", **kwargs)
+    except (ImportError, ValueError):
+        return pd.read_csv(path, **kwargs)
+
 print("Loading CSV files...")
-labs = pd.read_csv(labs_path)
-diag = pd.read_csv(diag_path)
+labs = _read_csv_fast(labs_path)
+diag = _read_csv_fast(diag_path)
 random_notes = pd.read_csv(random_notes_path)
 
+# Dictionary-encode the heavily repeated id/name columns: groupby/isin run on
+# the small code tables instead of millions of Python strings.
+labs["subject_id"] = pd.to_numeric(labs["subject_id"], downcast="integer")
+diag["subject_id"] = pd.to_numeric(diag["subject_id"], downcast="integer")
+random_notes["subject_id"] = pd.to_numeric(random_notes["subject_id"], downcast="integer")
+
 # ======================================================
 # Diagnosis table normalization: use icd_code column
 # ======================================================
-diag["icd_code"] = diag["icd_code"].astype(str).str.upper()
+diag["icd_code"] = diag["icd_code"].astype(str).str.upper().astype("category")
 
 # ======================================================
 # Extract TSH / T3 / T4 items from labs
 # ======================================================
-labs["item"] = labs["test_name"].str.upper()
+# Upper-case once per distinct test name and broadcast via the category codes
+# (robust to names that collide after upper-casing, and to NaN names).
+labs["test_name"] = labs["test_name"].astype("category")
+_codes = labs["test_name"].cat.codes.to_numpy()
+_upper = labs["test_name"].cat.categories.str.upper().to_numpy(dtype=object)
+labs["item"] = pd.Series(
+    np.where(_codes >= 0, _upper[_codes], np.nan), index=labs.index, dtype="category"
+)
 
 # Use test_value as numeric value (float)
 labs["valuenum"] = pd.to_numeric(labs["test_value"], errors="coerce")
 
+# Hormone masks, computed once and reused by categories A-D
+# (regex=False: plain substring scan, the patterns have no meta-chars).
+is_tsh = labs["item"].str.contains("TSH", regex=False, na=False)
+is_t3 = labs["item"].str.contains("T3", regex=False, na=False)
+is_t4 = labs["item"].str.contains("T4", regex=False, na=False)
+
+def _sample_ids(candidates, k):
+    """Uniformly sample up to k unique ids without the set→list→shuffle churn."""
+    candidates = pd.unique(np.asarray(candidates))
+    return np.random.choice(candidates, size=min(k, len(candidates)), replace=False)
+
 # ======================================================
 # Category A: Hyperthyroidism (TSH↓ + E05)
 # ======================================================
-hyper_ids = set()
-
-# TSH < 0.27
-hyper_ids |= set(
-    labs[(labs["item"].str.contains("TSH")) &
-         (labs["valuenum"] < 0.27)]["subject_id"]
-)
-
-# ICD E05*
-hyper_ids |= set(diag[diag["icd_code"].str.startswith("E05")]["subject_id"])
-
-hyper_ids = list(hyper_ids)
-np.random.shuffle(hyper_ids)
-hyper_ids = hyper_ids[:PER_CLASS]
+hyper_cand = np.concatenate([
+    # TSH < 0.27
+    labs.loc[is_tsh & (labs["valuenum"] < 0.27), "subject_id"].to_numpy(),
+    # ICD E05*
+    diag.loc[diag["icd_code"].str.startswith("E05"), "subject_id"].to_numpy(),
+])
+hyper_ids = _sample_ids(hyper_cand, PER_CLASS)
 
 print("A Hyper:", len(hyper_ids))
 
 # ======================================================
 # Category B: Hypothyroidism (TSH↑ + E03)
 # ======================================================
-hypo_ids = set()
-
-# TSH > 4.2
-hypo_ids |= set(
-    labs[(labs["item"].str.contains("TSH")) &
-         (labs["valuenum"] > 4.2)]["subject_id"]
-)
-
-# ICD E03*
-hypo_ids |= set(diag[diag["icd_code"].str.startswith("E03")]["subject_id"])
-
-hypo_ids = list(hypo_ids)
-np.random.shuffle(hypo_ids)
-hypo_ids = hypo_ids[:PER_CLASS]
+hypo_cand = np.concatenate([
+    # TSH > 4.2
+    labs.loc[is_tsh & (labs["valuenum"] > 4.2), "subject_id"].to_numpy(),
+    # ICD E03*
+    diag.loc[diag["icd_code"].str.startswith("E03"), "subject_id"].to_numpy(),
+])
+hypo_ids = _sample_ids(hypo_cand, PER_CLASS)
 
 print("B Hypo:", len(hypo_ids))
 
@@ -79,71 +97,53 @@ print("B Hypo:", len(hypo_ids))
 # ======================================================
 diag_ids = set(diag["subject_id"])
 
-border_ids = set()
-
-# Borderline: TSH ∈ [3.0, 4.2] without diagnosis
-border_ids |= set(
-    labs[(labs["item"].str.contains("TSH")) &
-         (labs["valuenum"].between(3.0, 4.2)) &
-         (~labs["subject_id"].isin(diag_ids))]["subject_id"]
-)
-
-# Borderline low-normal: TSH ∈ [0.27, 0.40]
-border_ids |= set(
-    labs[(labs["item"].str.contains("TSH")) &
-         (labs["valuenum"].between(0.27, 0.40)) &
-         (~labs["subject_id"].isin(diag_ids))]["subject_id"]
-)
-
-border_ids = list(border_ids)
-np.random.shuffle(border_ids)
-border_ids = border_ids[:PER_CLASS]
+# Borderline: TSH ∈ [3.0, 4.2] or [0.27, 0.40], without diagnosis
+border_cand = labs.loc[
+    is_tsh &
+    (labs["valuenum"].between(3.0, 4.2) | labs["valuenum"].between(0.27, 0.40)) &
+    (~labs["subject_id"].isin(diag_ids)),
+    "subject_id"
+].to_numpy()
+border_ids = _sample_ids(border_cand, PER_CLASS)
 
 print("C Borderline:", len(border_ids))
 
 # ======================================================
 # Category D: Multiple normal measurements
 # ======================================================
-def is_normal(group):
-    for _, row in group.iterrows():
-        v = row["valuenum"]
-        name = row["item"]
-        if pd.isna(v):
-            continue
-        if "TSH" in name and not (0.27 <= v <= 4.2):
-            return False
-        if "T3" in name and not (0.8 <= v <= 2.0):
-            return False
-        if "T4" in name and not (0.8 <= v <= 1.9):
-            return False
-    return True
-
-multi_normal = []
-
-for sid, g in labs.groupby("subject_id"):
-    if len(g) >= 3 and is_normal(g):
-        multi_normal.append(sid)
-
-np.random.shuffle(multi_normal)
-multi_normal = multi_normal[:PER_CLASS]
+# Vectorized: a row is "abnormal" when its item matches a hormone and the
+# value is out of range; NaN values never count as abnormal (same as the old
+# per-row loop that skipped them).
+v = labs["valuenum"]
+
+ok = pd.Series(True, index=labs.index)
+ok &= ~(is_tsh & ~v.between(0.27, 4.2))
+ok &= ~(is_t3 & ~v.between(0.8, 2.0))
+ok &= ~(is_t4 & ~v.between(0.8, 1.9))
+ok |= v.isna()
+
+grp = labs.assign(ok=ok).groupby("subject_id")
+sizes = grp.size()
+all_ok = grp["ok"].all()
+multi_normal = _sample_ids(sizes[(sizes >= 3) & all_ok].index.to_numpy(), PER_CLASS)
 
 print("D Normal:", len(multi_normal))
 
 # ======================================================
 # Category E: Random normal
 # ======================================================
-random_ids = list(set(random_notes["subject_id"]) - diag_ids)
-np.random.shuffle(random_ids)
-random_ids = random_ids[:PER_CLASS]
+rand_cand = random_notes.loc[~random_notes["subject_id"].isin(diag_ids),
+                             "subject_id"].to_numpy()
+random_ids = _sample_ids(rand_cand, PER_CLASS)
 
 print("E Random:", len(random_ids))
 
 # ======================================================
 # Output
 # ======================================================
-final_ids = list(set(
-    hyper_ids + hypo_ids + border_ids + multi_normal + random_ids
-))
+final_ids = pd.unique(np.concatenate(
+    [hyper_ids, hypo_ids, border_ids, multi_normal, random_ids]
+)).tolist()
 
 print("Final count:", len(final_ids))
 
@@ -69,6 +69,8 @@ if has_wide and has_long:
 elif has_long and not has_wide:
     # Pivot long format to wide format
     # Keep only the two note types of interest
+    # (dictionary-encoded: isin/groupby work on two categories, not N strings)
+    df["note_source"] = df["note_source"].astype("category")
     df = df[df["note_source"].isin(["discharge", "radiology"])].copy()
 
     # Aggregate and merge texts by (sid, hadm_id, note_source)
@@ -103,6 +105,10 @@ else:
     )
 
 # ------------- Cleaning and merging -------------
+# Drop exact duplicate rows first (C-side) so the per-group Python dedupe in
+# merge_texts only sees genuinely distinct texts.
+df = df.drop_duplicates(subset=["subject_id", "hadm_id", "discharge_text", "radiology_text"])
+
 # Aggregate again by (subject_id, hadm_id) to handle multiple rows even in wide input
 df_clean = (
     df.groupby(["subject_id", "hadm_id"], as_index=False)
@@ -112,16 +118,25 @@ df_clean = (
       })
 )
 
-# Remove rows where both text fields are empty
-mask_any = (df_clean["discharge_text"].str.strip() != "") | (df_clean["radiology_text"].str.strip() != "")
-df_clean = df_clean.loc[mask_any].copy()
+# Strip each text column once; both masks reuse the cached Series.
+d = df_clean["discharge_text"].str.strip()
+r = df_clean["radiology_text"].str.strip()
 
-# If both texts are required, apply additional filtering
+# Remove rows where both text fields are empty (or require both, per config)
 if REQUIRE_BOTH:
-    mask_both = (df_clean["discharge_text"].str.strip() != "") & (df_clean["radiology_text"].str.strip() != "")
-    df_clean = df_clean.loc[mask_both].copy()
+    df_clean = df_clean.loc[d.ne("") & r.ne("")].copy()
+else:
+    df_clean = df_clean.loc[d.ne("") | r.ne("")].copy()
 
 print(f"Records after cleaning: {len(df_clean):,}")
 OUTPUT_PATH.parent.mkdir(parents=True, exist_ok=True)
 df_clean.to_csv(OUTPUT_PATH, index=False)
 print(f"Saved to: {OUTPUT_PATH}")
+
+# Parquet sidecar: the LLM extraction driver prefers this on restart —
+# columnar + snappy loads the long note columns far faster than CSV.
+try:
+    df_clean.to_parquet(OUTPUT_PATH.with_suffix(".parquet"), compression="snappy")
+    print(f"Parquet sidecar saved: {OUTPUT_PATH.with_suffix('.parquet')}")
+except ImportError:
+    print("[WARN] pyarrow not installed, skipping parquet sidecar")
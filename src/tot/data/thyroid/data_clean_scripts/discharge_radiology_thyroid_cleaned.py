@@ -27,9 +27,22 @@ OUTPUT_PATH = DATA_CLEANED / "discharge_radiology_thyroid_cleaned.csv"
 CHUNK_SIZE = 200_000  # Read 200k rows per chunk, suitable for large files
 # ====================================================
 
+def _iter_csv_chunks(path, chunk_size):
+    """Stream the CSV as DataFrame chunks; uses the multithreaded PyArrow
+    reader when available, otherwise pandas' chunked C parser."""
+    try:
+        from pyarrow import csv as pa_csv
+        reader = pa_csv.open_csv(str(path))
+        for batch in reader:
+            yield batch.to_pandas()
+    except ImportError:
+        for chunk in pd.read_csv(path, chunksize=chunk_size, low_memory=False):
+            yield chunk
+
+
 print("🔹 Step 1: Reading CSV in chunks ...")
 chunks = []
-for chunk in pd.read_csv(DATA_PATH, chunksize=CHUNK_SIZE, low_memory=False):
+for chunk in _iter_csv_chunks(DATA_PATH, CHUNK_SIZE):
     # Normalize column names (case, whitespace)
     chunk.columns = [c.strip().lower() for c in chunk.columns]
 
@@ -69,6 +82,12 @@ def merge_texts(series):
     return "\n---\n".join(unique_texts) if unique_texts else ""
 
 
+# Drop exact duplicate rows first (C-side) so the per-group Python dedupe in
+# merge_texts only sees genuinely distinct texts.
+before_dedupe = len(df)
+df = df.drop_duplicates(subset=["subject_id", "hadm_id", "discharge_text", "radiology_text"])
+print(f"Exact-duplicate rows removed: {before_dedupe - len(df):,}")
+
 # Group by admission
 df_grouped = (
     df.groupby(["subject_id", "hadm_id"], as_index=False)
@@ -84,10 +103,10 @@ print(f"Record count after aggregation: {len(df_grouped):,}")
 print("🔹 Step 4: Removing completely empty texts (no discharge and no radiology) ...")
 df_grouped["discharge_text"] = df_grouped["discharge_text"].fillna("").astype(str)
 df_grouped["radiology_text"] = df_grouped["radiology_text"].fillna("").astype(str)
-df_grouped = df_grouped.loc[
-    (df_grouped["discharge_text"].str.strip() != "") |
-    (df_grouped["radiology_text"].str.strip() != "")
-    ]
+# Strip each column once and reuse the cached Series for the mask.
+d = df_grouped["discharge_text"].str.strip()
+r = df_grouped["radiology_text"].str.strip()
+df_grouped = df_grouped.loc[d.ne("") | r.ne("")]
 
 print(f"Record count after cleaning: {len(df_grouped):,}")
 
@@ -95,3 +114,11 @@ print(f"Record count after cleaning: {len(df_grouped):,}")
 OUTPUT_PATH.parent.mkdir(parents=True, exist_ok=True)
 df_grouped.to_csv(OUTPUT_PATH, index=False)
 print(f"✅ Clean file saved: {OUTPUT_PATH}")
+
+# Parquet sidecar: the LLM extraction driver prefers this on restart —
+# columnar + snappy loads the long note columns far faster than CSV.
+try:
+    df_grouped.to_parquet(OUTPUT_PATH.with_suffix(".parquet"), compression="snappy")
+    print(f"✅ Parquet sidecar saved: {OUTPUT_PATH.with_suffix('.parquet')}")
+except ImportError:
+    print("[WARN] pyarrow not installed, skipping parquet sidecar")
@@ -17,12 +17,32 @@ Batch extractor (Ollama) with checkpoint for thyroid-related info.
 import os
 import re
 import csv
+import functools
+import hashlib
+import sqlite3
 import time
 import json
 import argparse
+import threading
 import requests
 import pandas as pd
 from pathlib import Path
+from requests.adapters import HTTPAdapter, Retry
+
+
+try:
+    import orjson  # C JSON codec; the streaming path parses one JSON chunk per line
+except ImportError:
+    orjson = None
+
+
+def _json_dumps_bytes(obj):
+    return orjson.dumps(obj) if orjson is not None else json.dumps(obj).encode("utf-8")
+
+
+def _json_loads(s):
+    return orjson.loads(s) if orjson is not None else json.loads(s)
+
 
 # ====== GPU detection ======
 def check_gpu():
@@ -38,7 +58,10 @@ def check_gpu():
         print("[INFO] torch not installed — skipping GPU detection.")
 
 # ====== YOU MAY CHANGE THESE ======
-MODEL_NAME       = "qwen3:8b"
+# Q4_K_M weights: decode is VRAM-bandwidth bound, so int4 roughly doubles
+# tokens/sec vs fp16 with negligible extraction-accuracy loss.
+# One-off setup: ollama pull qwen3:8b-q4_K_M
+MODEL_NAME       = "qwen3:8b-q4_K_M"
 OLLAMA_ENDPOINT  = "http://localhost:11434/api/generate"
 # OLLAMA_ENDPOINT  = "http://frp-sea.com:11434/api/generate"
 
@@ -68,6 +91,38 @@ print(f"[INFO] OUTPUT DIR: {OUTPUT_DIR}")
 # Prompt template (4 sections, no Diagnosis)
 TEMPLATE_PATH = str(DATA_ROOT / "prompts" / "extract_thyroid_related.txt")
 
+# ====== Prompt cache ======
+# sha256(prompt) -> raw response, persisted in sqlite. Duplicate notes and
+# reruns outside the UID resume scope skip the model entirely.
+CACHE_DB_PATH = OUTPUT_DIR / "llm_prompt_cache.db"
+
+_cache_lock = threading.Lock()
+_cache_conn = None
+
+
+def _cache_db():
+    global _cache_conn
+    if _cache_conn is None:
+        _cache_conn = sqlite3.connect(str(CACHE_DB_PATH), check_same_thread=False)
+        _cache_conn.execute("CREATE TABLE IF NOT EXISTS cache(h BLOB PRIMARY KEY, raw TEXT)")
+        _cache_conn.commit()
+    return _cache_conn
+
+
+def _cache_get(prompt: str):
+    h = hashlib.sha256(prompt.encode("utf-8")).digest()
+    with _cache_lock:
+        row = _cache_db().execute("SELECT raw FROM cache WHERE h=?", (h,)).fetchone()
+    return h, (row[0] if row else None)
+
+
+def _cache_put(h: bytes, raw: str):
+    with _cache_lock:
+        conn = _cache_db()
+        conn.execute("INSERT OR IGNORE INTO cache(h, raw) VALUES (?, ?)", (h, raw))
+        conn.commit()
+
+
 
 # Context and truncation
 NUM_CTX = 8192
@@ -76,7 +131,11 @@ PRINT_THINK = True          # Whether to print <think> content
 PRINT_OUTPUT = True         # Whether to print cleaned output
 PRINT_MAX_CHARS = None      # Max chars to print in console to avoid flooding; None = no truncation
 
-MAX_CHARS_PER_DOC = None
+# Per-document character budget sized against NUM_CTX: prompt-eval cost grows
+# with every input token, so 20k+ char discharge summaries are windowed down
+# around their thyroid mentions before they reach the model.
+MAX_CHARS_PER_DOC = 6000
+KEYWORD_WINDOW = 800  # chars kept on each side of a keyword match
 
 SECTIONS = [
     "Symptoms",
@@ -85,10 +144,72 @@ SECTIONS = [
     "Treatment or Medication",
 ]
 
+# Hot-loop regexes compiled once at import.
+_THINK_RE = re.compile(r"<think>\s*(.*?)\s*</think>", re.DOTALL | re.IGNORECASE)
+_THINK_STRIP_RE = re.compile(r"<think>.*?</think>\s*", re.DOTALL | re.IGNORECASE)
+_SECTION_SPLIT_RE = re.compile(r"(?m)^###\s*([^:\n]+?)\s*:\s*")
+# Lowered names of the expected sections, for is_all_none's header filter.
+_SECTION_NAMES = frozenset(name.lower() for name in SECTIONS)
+
+# JSON-constrained output: the model fills fixed keys instead of spending
+# tokens on the ### boilerplate, and parsing becomes a single loads() with
+# no regex ambiguity. Responses are rendered back to the ### layout so the
+# downstream cleaners keep working unchanged.
+JSON_KEYS = ["symptoms", "physical_findings", "imaging_findings", "treatment_or_medication"]
+_JSON_INSTRUCTION = (
+    "\n\nReturn ONLY a JSON object with exactly these keys: "
+    '"symptoms", "physical_findings", "imaging_findings", '
+    '"treatment_or_medication". Use null for any section without '
+    "information. Do not use the ### section layout."
+)
+
+# With format=json the stream carries key/value pairs, not ### headers, so
+# the all-None early stop keys on the partial object instead: each section
+# key is emitted at most once, so once every key has arrived as null the
+# rest of the decode is just closing braces.
+_JSON_NULL_RES = [re.compile(rf'"{key}"\s*:\s*null') for key in JSON_KEYS]
+
+
+def _sections_from_json(result_text: str):
+    """Render the model's JSON object back to the ### section layout.
+    Returns None when the text is not a JSON object (legacy responses)."""
+    try:
+        obj = _json_loads(result_text)
+    except ValueError:
+        return None
+    if not isinstance(obj, dict):
+        return None
+    lines = []
+    for name, key in zip(SECTIONS, JSON_KEYS):
+        v = obj.get(key)
+        if v is None or (isinstance(v, str) and not v.strip()):
+            v = "None"
+        elif isinstance(v, (list, tuple)):
+            v = "; ".join(str(x) for x in v) or "None"
+        lines.append(f"### {name}: {v}")
+    return "\n".join(lines)
+
+
 DISCHARGE_CANDS = ["discharge_summary", "discharge_text", "note_text", "discharge"]
 RADIOLOGY_CANDS = ["radiology_report", "radiology_text", "imaging_report", "radiology"]
 ID_CANDS        = ["subject_id", "hadm_id", "note_id", "stay_id", "charttime"]
 
+# Module-level so both the row filter and the prompt windowing share one
+# compiled alternation (\b word boundaries, optional plural).
+THYROID_KEYWORDS = [
+    "thyroid", "t3", "t4", "tsh",
+    "hypothyroid", "hyperthyroid", "thyrotoxic", "thyrotoxicosis",
+    "graves", "hashimoto",
+    "levothyroxine", "synthroid", "methimazole", "propylthiouracil", "ptu",
+    "goiter", "thyroidectomy", "thyroid nodule", "thyroid mass",
+    "papillary", "follicular", "medullary", "anaplastic",
+    "thyroid cancer", "thyroid carcinoma"
+]
+THYROID_KEYWORD_RE = re.compile(
+    r"\b(?:" + "|".join(map(re.escape, THYROID_KEYWORDS)) + r")s?\b",
+    re.IGNORECASE,
+)
+
 
 # ====== Helpers ======
 def _load_uids_from_csv(path: str) -> set:
@@ -116,7 +237,9 @@ def _ensure_skip_writer(path: str):
         f.flush()
     return f, w
 
+@functools.lru_cache(maxsize=1)
 def _read_template() -> str:
+    # Cached: build_prompt runs per row and must not re-stat/re-read the file.
     p = Path(TEMPLATE_PATH)
     if p.exists():
         return p.read_text(encoding="utf-8")
@@ -133,63 +256,139 @@ def _read_template() -> str:
         "If no info, write 'None' under each section."
     )
 
+def _truncate_doc(text: str) -> str:
+    """Cap a document at MAX_CHARS_PER_DOC. Long notes keep ±KEYWORD_WINDOW
+    chars around each thyroid mention (overlapping windows merged); notes
+    without mentions keep head + tail."""
+    if MAX_CHARS_PER_DOC is None or len(text) <= MAX_CHARS_PER_DOC:
+        return text
+    spans = []
+    kept = 0
+    for m in THYROID_KEYWORD_RE.finditer(text):
+        start = max(0, m.start() - KEYWORD_WINDOW)
+        end = min(len(text), m.end() + KEYWORD_WINDOW)
+        if spans and start <= spans[-1][1]:
+            kept += end - spans[-1][1]
+            spans[-1][1] = end
+        else:
+            kept += end - start
+            spans.append([start, end])
+        if kept >= MAX_CHARS_PER_DOC:
+            break
+    if spans:
+        return "\n... [snip] ...\n".join(text[s:e] for s, e in spans)[:MAX_CHARS_PER_DOC]
+    head = MAX_CHARS_PER_DOC * 2 // 3
+    tail = MAX_CHARS_PER_DOC - head
+    return text[:head] + "\n... [snip] ...\n" + text[-tail:]
+
 def build_prompt(discharge_text: str, radiology_text: str) -> str:
     template = _read_template()
     return (template
-            .replace("{{DISCHARGE_TEXT}}", discharge_text or "")
-            .replace("{{RADIOLOGY_TEXT}}", radiology_text or ""))
+            .replace("{{DISCHARGE_TEXT}}", _truncate_doc(discharge_text or ""))
+            .replace("{{RADIOLOGY_TEXT}}", _truncate_doc(radiology_text or ""))
+            + _JSON_INSTRUCTION)
 
 def query_llm(prompt: str, model: str = MODEL_NAME, endpoint: str = OLLAMA_ENDPOINT, sess: requests.Session = None) -> str:
     payload = {
         "model": model,
         "prompt": prompt,
-        "stream": False,
+        "stream": True,  # Stream tokens so all-None generations can be aborted early
         "keep_alive": "10m",  # Keep the model resident to avoid reloading for each request
+        "format": "json",  # constrained decoding: keys are fixed, missing -> null
         "options": {
             "num_ctx": NUM_CTX,
             "temperature": 0.2,
             "top_p": 0.9,
+            "num_predict": 512,  # JSON output is compact; cap runaway decodes
             # "num_predict": -1,  # Limit generation length for speed and stability
         },
     }
+    h, cached = _cache_get(prompt)
+    if cached is not None:
+        return cached
     s = sess or requests
-    r = s.post(endpoint, json=payload, timeout=600)  # Increase timeout from 120s to 600s
-    r.raise_for_status()
-    data = r.json()
-    return data.get("response", "") or data.get("message", {}).get("content", "")
+    chunks = []
+    with s.post(endpoint, data=_json_dumps_bytes(payload),
+                headers={"Content-Type": "application/json"},
+                timeout=600, stream=True) as r:  # Increase timeout from 120s to 600s
+        r.raise_for_status()
+        for line in r.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            data = _json_loads(line)
+            chunks.append(data.get("response", ""))
+            if data.get("done"):
+                break
+            # Early stop: once every section key has streamed in as null,
+            # the rest of the decode is wasted GPU time — close the stream
+            # and return. The truncated partial has no ### headers, so the
+            # caller's is_all_none check still classifies it as all-None.
+            raw = "".join(chunks)
+            if all(p.search(raw) for p in _JSON_NULL_RES):
+                r.close()
+                break
+    raw = "".join(chunks)
+    _cache_put(h, raw)
+    return raw
+
+
+
+def _prewarm_model(sess: requests.Session):
+    """Load the model before the worker pool starts: the first real request
+    otherwise absorbs the ~30s model-load latency and skews progress logs."""
+    payload = {"model": MODEL_NAME, "prompt": "ping", "stream": False,
+               "keep_alive": "1h", "options": {"num_predict": 1}}
+    try:
+        r = sess.post(OLLAMA_ENDPOINT, data=_json_dumps_bytes(payload),
+                      headers={"Content-Type": "application/json"}, timeout=600)
+        r.raise_for_status()
+        print("[INFO] Model pre-warmed")
+    except Exception as e:
+        print(f"[WARN] Model pre-warm failed (continuing): {e}")
 
 
 def extract_think(text: str) -> str:
-    m = re.search(r"<think>\s*(.*?)\s*</think>", text or "", flags=re.DOTALL | re.IGNORECASE)
+    m = _THINK_RE.search(text or "")
     return m.group(1).strip() if m else ""
 
 def remove_think(text: str) -> str:
-    return re.sub(r"<think>.*?</think>\s*", "", text or "", flags=re.DOTALL | re.IGNORECASE)
+    return _THINK_STRIP_RE.sub("", text or "")
 
 def is_all_none(output_text: str) -> bool:
     if not output_text.strip():
         return True
-    for name in SECTIONS:
-        # Allow variable spaces/colon after ###
-        pat = rf"###\s*{re.escape(name)}\s*:\s*(.*?)(?=\n###\s*|$)"
-        m = re.search(pat, output_text or "", flags=re.DOTALL | re.IGNORECASE)
-        chunk = (m.group(1).strip() if m else "")
-        if chunk and chunk.lower() != "none":
+    # One split on the ### headers instead of a full-text regex scan per
+    # section; parts alternate [preamble, name, body, name, body, ...].
+    # Only the four expected SECTIONS count as content: a response carrying
+    # nothing but a forbidden header (e.g. ### Diagnosis:) yields nothing
+    # downstream and must still be treated as all-None.
+    parts = _SECTION_SPLIT_RE.split(output_text)
+    for name, body in zip(parts[1::2], parts[2::2]):
+        if name.strip().lower() not in _SECTION_NAMES:
+            continue
+        body = body.strip()
+        if body and body.lower() != "none":
             return False
     return True
 
-def _get_uid(row: dict, idx: int) -> str:
-    parts = [str(row.get(k, "")).strip() for k in ID_CANDS if str(row.get(k, "")).strip()]
+def _get_uid(id_vals, idx: int) -> str:
+    parts = [s for s in (str(v).strip() for v in id_vals) if s]
     return "||".join(parts) if parts else f"idx-{idx}"
 
-def _load_processed(out_csv: str) -> set:
-    s = set()
+def _load_prev_outputs(out_csv: str) -> dict:
+    """
+    uid -> (llm_thinking, llm_output) for rows already in the output CSV.
+    On resume these are broadcast to duplicate-note group members that were
+    never written, instead of skip-logging them as already_processed (which
+    would exclude them from every later run).
+    """
+    outs = {}
     if os.path.exists(out_csv) and os.path.getsize(out_csv) > 0:
         with open(out_csv, "r", encoding="utf-8", newline="") as f:
             for r in csv.DictReader(f):
                 if r.get("uid"):
-                    s.add(r["uid"])
-    return s
+                    outs[r["uid"]] = (r.get("llm_thinking", ""), r.get("llm_output", ""))
+    return outs
 
 def _ensure_writer(path: str):
     exists = os.path.exists(path) and os.path.getsize(path) > 0
@@ -215,14 +414,32 @@ import re
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import re
 
-def process_records(csv_path: str, limit: int = None, skip: int = 0, sleep_s: float = 0.1):
+def _load_input_table(csv_path: str):
+    """Prefer the parquet sidecar written by the cleaning scripts: columnar
+    and compressed, so restarts skip re-parsing the long note columns from
+    CSV. Falls back to the CSV when no sidecar exists. Either way only the
+    id/note candidate columns are materialized — wide EHR exports carry many
+    text fields this script never touches."""
+    wanted = set(ID_CANDS) | set(DISCHARGE_CANDS) | set(RADIOLOGY_CANDS)
+    pq_path = os.path.splitext(csv_path)[0] + ".parquet"
+    if os.path.exists(pq_path):
+        print(f"[INFO] Loading parquet sidecar: {pq_path}")
+        import pyarrow.parquet as pq
+        header = pq.read_schema(pq_path).names
+        return pd.read_parquet(pq_path, columns=[c for c in header if c in wanted])
+    header = pd.read_csv(csv_path, nrows=0).columns
+    return pd.read_csv(csv_path, usecols=[c for c in header if c in wanted],
+                       on_bad_lines="skip", low_memory=False)
+
+def process_records(csv_path: str, limit: int = None, skip: int = 0, sleep_s: float = 0.1,
+                    workers: int = 4):
     csv_path = str(csv_path)
-    if not os.path.exists(csv_path):
+    if not os.path.exists(csv_path) and not os.path.exists(os.path.splitext(csv_path)[0] + ".parquet"):
         print("CSV not found:", csv_path)
         return
 
-    # ===== Step 1: Read CSV =====
-    df = pd.read_csv(csv_path, on_bad_lines="skip", low_memory=False)
+    # ===== Step 1: Read input table (parquet sidecar preferred) =====
+    df = _load_input_table(csv_path)
     total = len(df)
 
     # ===== Step 2: Auto-detect column names =====
@@ -231,28 +448,15 @@ def process_records(csv_path: str, limit: int = None, skip: int = 0, sleep_s: fl
     print(f"[DEBUG] Using discharge_col = '{discharge_col}', radiology_col = '{radiology_col}'")
 
     # ===== Step 3: Keyword filtering (stricter) =====
-    THYROID_KEYWORDS = [
-        "thyroid", "t3", "t4", "tsh",
-        "hypothyroid", "hyperthyroid", "thyrotoxic", "thyrotoxicosis",
-        "graves", "hashimoto",
-        "levothyroxine", "synthroid", "methimazole", "propylthiouracil", "ptu",
-        "goiter", "thyroidectomy", "thyroid nodule", "thyroid mass",
-        "papillary", "follicular", "medullary", "anaplastic",
-        "thyroid cancer", "thyroid carcinoma"
-    ]
-
-    def contains_keywords(row):
-        combined = (str(row.get(discharge_col, '')) + ' ' +
-                    str(row.get(radiology_col, ''))).lower()
-        combined = re.sub(r"[^a-z0-9\s]", " ", combined)
-        for kw in THYROID_KEYWORDS:
-            pattern = rf"\b{kw}s?\b"
-            if re.search(pattern, combined):
-                return True
-        return False
+    # One alternation regex over the concatenated note text instead of a
+    # Python call per row re-running ~15 searches; \b word boundaries make the
+    # old punctuation-stripping pass unnecessary.
+    combined = (df[discharge_col].fillna("").astype(str) + " " +
+                df[radiology_col].fillna("").astype(str))
+    mask = combined.str.contains(THYROID_KEYWORD_RE, regex=True, na=False)
 
     before_filter = len(df)
-    df = df[df.apply(contains_keywords, axis=1)].reset_index(drop=True)
+    df = df.loc[mask].reset_index(drop=True)
     after_filter = len(df)
     print(f"[FILTER] Filtered records: {before_filter:,} → {after_filter:,} (kept {after_filter / before_filter:.2%})")
 
@@ -260,8 +464,8 @@ def process_records(csv_path: str, limit: int = None, skip: int = 0, sleep_s: fl
     out_path = str(OUTPUT_DIR / "llm_thyroid_summary_filtered_original.csv")
     # out_path = str(OUTPUT_DIR / "llm_random_summary_filtered_original.csv")
 
-    processed = set()
-    processed |= _load_processed(out_path)
+    prev_outputs = _load_prev_outputs(out_path)
+    processed = set(prev_outputs)
     processed |= _load_uids_from_csv(str(SKIP_LOG_PATH))
     f, writer = _ensure_writer(out_path)
     skip_f, skip_writer = _ensure_skip_writer(str(SKIP_LOG_PATH))
@@ -272,24 +476,49 @@ def process_records(csv_path: str, limit: int = None, skip: int = 0, sleep_s: fl
     print(f"[INFO] Remaining: {total - len(processed):,}")
 
     # ===== Step 5: Parallel configuration =====
-    MAX_WORKERS = 1
+    # Overlapping prompt-eval of request N+1 with decode of N keeps the Ollama
+    # GPU busy; scale this together with the server's OLLAMA_NUM_PARALLEL.
+    MAX_WORKERS = max(1, workers)
     print(f"[INFO] Parallel mode: {MAX_WORKERS} workers (ThreadPoolExecutor)")
     sess = requests.Session()
+    # Pool sized above the worker count, with adapter-level retries replacing
+    # the per-call retry loop (connection reuse + no pool-exhaustion stalls).
+    adapter = HTTPAdapter(
+        pool_connections=MAX_WORKERS * 2,
+        pool_maxsize=MAX_WORKERS * 2,
+        max_retries=Retry(total=3, backoff_factor=1.5,
+                          status_forcelist=[500, 502, 503, 504]),
+    )
+    sess.mount("http://", adapter)
+    sess.mount("https://", adapter)
+    _prewarm_model(sess)
+    # The workers read `processed` while the main thread mutates it.
+    processed_lock = threading.Lock()
     done = skipped = 0
     started = time.time()
 
-    def process_one(idx, row):
-        rowd = row.to_dict()
-        uid = _get_uid(rowd, idx)
+    def process_one(idx, id_vals, discharge_text, radiology_text):
+        uid = _get_uid(id_vals, idx)
         result = {"uid": uid, "status": "", "reason": "", "llm_output": "", "llm_thinking": ""}
 
-        if uid in processed:
-            result["status"] = "skipped"
-            result["reason"] = "already_processed"
-            return result
-
-        discharge_text = str(rowd.get(discharge_col, "") or "")
-        radiology_text = str(rowd.get(radiology_col, "") or "")
+        with processed_lock:
+            already = uid in processed
+        if already:
+            prev = prev_outputs.get(uid)
+            if prev is not None:
+                # Already in the output CSV: return its cached output as a
+                # normal "done" result so duplicate-group members that were
+                # never written inherit it (the broadcast loop filters out
+                # this row itself via `processed`).
+                result["status"] = "done"
+                result["llm_thinking"], result["llm_output"] = prev
+                return result
+            # Skip-logged on a previous run: fall through and re-evaluate so
+            # unwritten duplicates still get a real decision; the prompt
+            # cache absorbs the repeat call.
+
+        discharge_text = "" if pd.isna(discharge_text) else str(discharge_text)
+        radiology_text = "" if pd.isna(radiology_text) else str(radiology_text)
         if not discharge_text.strip() and not radiology_text.strip():
             result["status"] = "skipped"
             result["reason"] = "empty_input"
@@ -297,23 +526,21 @@ def process_records(csv_path: str, limit: int = None, skip: int = 0, sleep_s: fl
 
         prompt = build_prompt(discharge_text, radiology_text)
 
-        tries = 0
-        while True:
-            try:
-                t0 = time.time()
-                raw = query_llm(prompt, sess=sess)
-                result["llm_time"] = round(time.time() - t0, 2)
-                break
-            except Exception as e:
-                tries += 1
-                if tries >= 3:
-                    result["status"] = "error"
-                    result["reason"] = str(e)
-                    return result
-                time.sleep(1.5 * tries)
+        # Retries live in the session adapter now (backoff included).
+        try:
+            t0 = time.time()
+            raw = query_llm(prompt, sess=sess)
+            result["llm_time"] = round(time.time() - t0, 2)
+        except Exception as e:
+            result["status"] = "error"
+            result["reason"] = str(e)
+            return result
 
         think_text = extract_think(raw)
         result_text = remove_think(raw)
+        converted = _sections_from_json(result_text)
+        if converted is not None:
+            result_text = converted
 
         if PRINT_THINK:
             print(f"\n[THINK {idx + 1}/{total} | uid={uid}]\n{think_text[:800]}\n" + "-" * 60)
@@ -329,42 +556,92 @@ def process_records(csv_path: str, limit: int = None, skip: int = 0, sleep_s: fl
             result["llm_thinking"] = think_text
         return result
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(process_one, idx, row): (idx, row) for idx, row in df.iterrows()}
-        for future in as_completed(futures):
-            idx, row = futures[future]
-            res = future.result()
-            uid = res["uid"]
-
-            if res["status"] == "done":
-                writer.writerow({
-                    "uid": uid,
-                    "subject_id": row.get("subject_id", ""),
-                    "hadm_id": row.get("hadm_id", ""),
-                    "llm_thinking": res["llm_thinking"],
-                    "llm_output": res["llm_output"],
-                })
-                f.flush()
-                done += 1
-            else:
-                skip_writer.writerow({
-                    "uid": uid,
-                    "subject_id": row.get("subject_id", ""),
-                    "hadm_id": row.get("hadm_id", ""),
-                    "reason": res["reason"],
-                })
-                skip_f.flush()
-                skipped += 1
-
-            processed.add(uid)
-            elapsed = round(time.time() - started, 1)
-            print(f"[PROGRESS] {done} done | {skipped} skipped | elapsed={elapsed:.1f}s | last uid={uid} | LLM={res.get('llm_time', 0)}s")
-
-            if limit and done >= limit:
-                break
+    # itertuples over just the needed columns: no per-row Series or dict
+    # allocation like iterrows()/to_dict().
+    id_cols = [c for c in ID_CANDS if c in df.columns]
+    sid_pos = id_cols.index("subject_id") if "subject_id" in id_cols else None
+    hadm_pos = id_cols.index("hadm_id") if "hadm_id" in id_cols else None
+    n_ids = len(id_cols)
+
+    # Buffer rows and flush in batches: one write syscall per FLUSH_EVERY
+    # rows instead of per row. A crash loses at most one buffer's worth,
+    # which the UID resume simply reprocesses.
+    FLUSH_EVERY = 64
+    out_buf, skip_buf = [], []
+
+    def _flush_buffers():
+        if out_buf:
+            writer.writerows(out_buf)
+            f.flush()
+            out_buf.clear()
+        if skip_buf:
+            skip_writer.writerows(skip_buf)
+            skip_f.flush()
+            skip_buf.clear()
+
+    # Duplicate (discharge, radiology) pairs share one LLM call: the first
+    # row of each pair is submitted, the result is broadcast to the rest.
+    pair_keys = (df[discharge_col].fillna("").astype(str) + "\x00" +
+                 df[radiology_col].fillna("").astype(str)).map(
+                     lambda s: hashlib.sha1(s.encode("utf-8")).hexdigest()).to_numpy()
 
-    f.close()
-    skip_f.close()
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {}
+            groups = {}  # pair key -> [(idx, id_vals, subject_id, hadm_id), ...]
+            for idx, vals in enumerate(
+                    df[id_cols + [discharge_col, radiology_col]].itertuples(index=False, name=None)):
+                id_vals = vals[:n_ids]
+                member = (idx, id_vals,
+                          id_vals[sid_pos] if sid_pos is not None else "",
+                          id_vals[hadm_pos] if hadm_pos is not None else "")
+                bucket = groups.setdefault(pair_keys[idx], [])
+                bucket.append(member)
+                if len(bucket) == 1:
+                    fut = executor.submit(process_one, idx, id_vals, vals[n_ids], vals[n_ids + 1])
+                    futures[fut] = pair_keys[idx]
+            for future in as_completed(futures):
+                key = futures[future]
+                res = future.result()
+
+                for idx, id_vals, subject_id, hadm_id in groups[key]:
+                    uid = _get_uid(id_vals, idx)
+                    with processed_lock:
+                        if uid in processed:
+                            continue
+                    if res["status"] == "done":
+                        out_buf.append({
+                            "uid": uid,
+                            "subject_id": subject_id,
+                            "hadm_id": hadm_id,
+                            "llm_thinking": res["llm_thinking"],
+                            "llm_output": res["llm_output"],
+                        })
+                        if len(out_buf) >= FLUSH_EVERY:
+                            _flush_buffers()
+                        done += 1
+                    else:
+                        skip_buf.append({
+                            "uid": uid,
+                            "subject_id": subject_id,
+                            "hadm_id": hadm_id,
+                            "reason": res["reason"],
+                        })
+                        if len(skip_buf) >= FLUSH_EVERY:
+                            _flush_buffers()
+                        skipped += 1
+                    with processed_lock:
+                        processed.add(uid)
+
+                elapsed = round(time.time() - started, 1)
+                print(f"[PROGRESS] {done} done | {skipped} skipped | elapsed={elapsed:.1f}s | last uid={res['uid']} | LLM={res.get('llm_time', 0)}s")
+
+                if limit and done >= limit:
+                    break
+    finally:
+        _flush_buffers()
+        f.close()
+        skip_f.close()
     elapsed = round(time.time() - started, 1)
     print(f"\n[OK] saved to: {out_path} | done={done}, skipped={skipped}, elapsed={elapsed}s")
 
@@ -376,5 +653,6 @@ if __name__ == "__main__":
     parser.add_argument("--limit", type=int, default=None, help="limit processed rows")
     parser.add_argument("--skip", type=int, default=0, help="skip N rows first")
     parser.add_argument("--sleep", type=float, default=0.01, help="sleep seconds between requests")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent Ollama requests")
     args = parser.parse_args()
-    process_records(args.csv, limit=args.limit, skip=args.skip, sleep_s=args.sleep)
+    process_records(args.csv, limit=args.limit, skip=args.skip, sleep_s=args.sleep, workers=args.workers)
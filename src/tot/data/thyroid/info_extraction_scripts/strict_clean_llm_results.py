@@ -15,45 +15,93 @@ NO_INFO_PATTERNS = [
 ]
 FIELDS = ["Symptoms", "Physical Findings", "Imaging Findings", "Treatment or Medication"]
 
+# Only these columns are used downstream; loading them with explicit dtypes
+# (string arrays, nullable int ids) avoids materializing every column as
+# Python objects. Int32 rather than int32 because the extractor can leave
+# hadm_id blank.
+READ_COLS = ["uid", "subject_id", "hadm_id", "llm_output"]
+READ_DTYPES = {"uid": "string", "subject_id": "Int32", "hadm_id": "Int32", "llm_output": "string"}
+
+# One compiled alternation shared by the column-wise "no info" masks.
+NO_INFO_RE = re.compile("|".join(map(re.escape, NO_INFO_PATTERNS)), re.IGNORECASE)
+
+# One compiled pattern per field, built at import; grab_field and the
+# vectorized extracts share these instead of re-parsing the f-string
+# pattern on every call.
+FIELD_RE = {
+    f: re.compile(rf"### {re.escape(f)}:\s*(.*?)(?=\n### |\Z)", re.I | re.S)
+    for f in FIELDS
+}
+
 def is_effective(text: str) -> bool:
-    content = (text or "").lower().strip()
-    if not content:
-        return False
-    return not any(p in content for p in NO_INFO_PATTERNS)
+    # Single pass of the compiled alternation instead of nine substring
+    # scans; IGNORECASE replaces the lower() copy.
+    content = (text or "").strip()
+    return bool(content) and NO_INFO_RE.search(content) is None
 
 def grab_field(output: str, field: str) -> str:
-    m = re.search(rf"### {re.escape(field)}:\s*(.*?)(?=\n### |\Z)", output or "", re.I | re.S)
+    m = FIELD_RE[field].search(output or "")
     return (m.group(1).strip() if m else "") or ""
 
 def clean_and_parse():
     if not INPUT_PATH.exists():
         print(f"Input not found: {INPUT_PATH}")
         return
-    df = pd.read_csv(INPUT_PATH)
+    header = pd.read_csv(INPUT_PATH, nrows=0).columns
+    if set(READ_COLS).issubset(header):
+        try:
+            df = pd.read_csv(INPUT_PATH, usecols=READ_COLS, dtype=READ_DTYPES, engine="pyarrow")
+        except ImportError:
+            df = pd.read_csv(INPUT_PATH, usecols=READ_COLS, dtype=READ_DTYPES)
+    else:
+        # Input predates one of the expected columns — take everything.
+        df = pd.read_csv(INPUT_PATH)
     print(f"Loaded {len(df)} rows from {INPUT_PATH.name}")
 
-    keep_rows = []
-    parsed_rows = []
-    for _, row in df.iterrows():
-        out = str(row.get("llm_output", "") or "")
-        field_vals = {f: grab_field(out, f) for f in FIELDS}
-        # Check whether at least one field contains effective information
-        if any(is_effective(v) for v in field_vals.values()):
-            keep_rows.append(row)
-            parsed_rows.append({
-                "uid": row.get("uid", ""),
-                "subject_id": row.get("subject_id", ""),
-                "hadm_id": row.get("hadm_id", ""),
-                **{f.replace(" ", "_").lower(): field_vals[f] for f in FIELDS}
-            })
-
-    df_keep = pd.DataFrame(keep_rows).drop_duplicates(subset=["uid"])
-    df_parsed = pd.DataFrame(parsed_rows).drop_duplicates(subset=["uid"])
+    # Column-wise parse: one vectorized str.extract per field instead of
+    # four re.search calls per row inside iterrows (no per-row Series).
+    out = df["llm_output"].fillna("").astype(str) if "llm_output" in df.columns else pd.Series("", index=df.index)
+    field_vals = {
+        f: out.str.extract(FIELD_RE[f])[0].fillna("").str.strip()
+        for f in FIELDS
+    }
+
+    # "Effective" mask per field: non-empty and no "no info" phrase; a row is
+    # kept when any field is effective.
+    effective = pd.DataFrame({
+        f: v.ne("") & ~v.str.contains(NO_INFO_RE, na=False)
+        for f, v in field_vals.items()
+    })
+    mask = effective.any(axis=1)
+
+    def _col(name):
+        return df[name] if name in df.columns else pd.Series("", index=df.index)
+
+    df_keep = df.loc[mask].drop_duplicates(subset=["uid"])
+    df_parsed = (
+        pd.DataFrame({
+            "uid": _col("uid"),
+            "subject_id": _col("subject_id"),
+            "hadm_id": _col("hadm_id"),
+            **{f.replace(" ", "_").lower(): field_vals[f] for f in FIELDS},
+        })
+        .loc[mask]
+        .drop_duplicates(subset=["uid"])
+    )
 
     df_keep.to_csv(OUTPUT_PATH, index=False)
     df_parsed.to_csv(PARSED_PATH, index=False)
     print(f"Saved strict filtered -> {OUTPUT_PATH}")
     print(f"Saved parsed columns  -> {PARSED_PATH}")
 
+    # Parquet sidecars: downstream stages that re-read these frames load
+    # them columnar with dtypes intact instead of re-parsing CSV text.
+    try:
+        df_keep.to_parquet(OUTPUT_PATH.with_suffix(".parquet"), compression="zstd", index=False)
+        df_parsed.to_parquet(PARSED_PATH.with_suffix(".parquet"), compression="zstd", index=False)
+        print(f"Saved parquet sidecars next to {OUTPUT_PATH.name} / {PARSED_PATH.name}")
+    except ImportError:
+        print("[WARN] pyarrow not installed, skipping parquet sidecars")
+
 if __name__ == "__main__":
     clean_and_parse()
@@ -1,3 +1,25 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _make_solve_batch(solve):
+    """
+    Wrap a per-patient `solve` into a batched `solve_batch(args, task, idxs)`.
+
+    The backend (vLLM server) uses continuous batching, so dispatching a whole
+    micro-batch of prompts concurrently lets it pack the sequences into one
+    running batch instead of seeing concurrency=1.
+    """
+    def solve_batch(args, task, idxs, to_print=False):
+        if not idxs:
+            return []
+        max_workers = min(len(idxs), getattr(args, "batch_size", 32))
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(solve, args, task, i, to_print) for i in idxs]
+            # Keep results aligned with idxs (futures preserve submission order).
+            return [f.result() for f in futures]
+    return solve_batch
+
+
 def get_method(name):
     if name == "bfs":
         from .bfs import solve
@@ -16,4 +38,7 @@ def get_method(name):
     else:
         raise ValueError(f"Unknown method: {name}")
 
-    return type('Method', (), {'solve': staticmethod(solve)})()
+    return type('Method', (), {
+        'solve': staticmethod(solve),
+        'solve_batch': staticmethod(_make_solve_batch(solve)),
+    })()
@@ -1,27 +1,29 @@
 import itertools
-import numpy as np
+import random
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
-from tot.models import completion
+from tot.methods.llm_cache import cached_completion
 
 # The GPT interface is wrapped in partial form to maintain compatibility with the original framework logic.
 def gpt(prompt, n=1, stop=None, model=None, temperature=0):
-    outputs = []
-    for _ in range(n):
-        out = completion(prompt, stop=stop, model=model)
-        outputs.append(out.strip())
-    return outputs
+    if n <= 1:
+        return [cached_completion(prompt, stop=stop, model=model).strip()]
+    # The n samples are independent and the backend call is I/O-bound, so
+    # fan them out instead of paying n sequential round-trips.
+    with ThreadPoolExecutor(max_workers=n) as ex:
+        return list(ex.map(
+            lambda i: cached_completion(prompt, stop=stop, model=model, sample_idx=i).strip(),
+            range(n)))
 
 def get_values(task, x, ys, n_evaluate_sample, cache_value=True):
-    values = []
-    local_value_cache = {}
-    for y in ys:
-        if y in local_value_cache:
-            value = 0
-        else:
-            value = get_value(task, x, y, n_evaluate_sample, cache_value=cache_value)
-            local_value_cache[y] = value
-        values.append(value)
-    return values
+    # Duplicate candidates are common in the beam; evaluate each unique y
+    # once and map the value back (the old per-loop cache also returned 0
+    # on a hit, zero-weighting duplicates in the selection step).
+    local_value_cache = {
+        y: get_value(task, x, y, n_evaluate_sample, cache_value=cache_value)
+        for y in dict.fromkeys(ys)
+    }
+    return [local_value_cache[y] for y in ys]
 
 def get_value(task, x, y, n_evaluate_sample, cache_value=True):
     value_prompt = task.value_prompt_wrap(x, y)
@@ -47,7 +49,6 @@ def get_votes(task, x, ys, n_evaluate_sample):
     return values
 
 def get_proposals(task, x, y):
-    propose_prompt = task.propose_prompt_wrap(x, y)
     propose_prompt = task.propose_prompt_wrap(x, y)
     proposals = gpt(propose_prompt, n=1, stop=None)[0].split('\n')
     return [y + _ + '\n' for _ in proposals]
@@ -79,8 +80,9 @@ def solve(args, task, idx, to_print=True):
             values = get_values(task, x, new_ys, args.n_evaluate_sample)
 
         if args.method_select == 'sample':
-            ps = np.array(values) / sum(values)
-            select_ids = np.random.choice(ids, size=args.n_select_sample, p=ps).tolist()
+            # random.choices normalizes the weights internally — no need to
+            # round-trip the handful of values through a NumPy array.
+            select_ids = random.choices(ids, weights=values, k=args.n_select_sample)
         elif args.method_select == 'greedy':
             select_ids = sorted(ids, key=lambda x: values[x], reverse=True)[:args.n_select_sample]
         select_new_ys = [new_ys[select_id] for select_id in select_ids]
@@ -95,7 +97,7 @@ def solve(args, task, idx, to_print=True):
     best_final_candidate = None
     if new_ys: # Check if the final step successfully generated candidates.
         # Based on the evaluation values ​​`values` from the final step, find the optimal candidate from the complete candidate list `new_ys`.
-        best_candidate_index = np.argmax(values)
+        best_candidate_index = max(range(len(values)), key=values.__getitem__)
         best_final_candidate = new_ys[best_candidate_index]
 
     if to_print:
@@ -11,32 +11,46 @@ Return Format: Aligned with CoT, `solve` returns `(["Final: 0/1"], info)`.
 `info['steps']` records complete intermediate information for each stage, facilitating disk entry in the checkpoints of `main.py`.
 """
 import re
-from tot.models import completion
+import sys
+from collections import namedtuple
+import numpy as np
+from tot.methods.llm_cache import cached_completion
 
 # =============== Flag Utility functions (using only program flags to avoid unit/threshold differences) ===============
+# Canonical flag strings, interned once. Flag values arriving from parsed
+# summaries are fresh string objects, so mapping them onto these canonical
+# pointers lets every `== HIGH` below short-circuit on identity.
+HIGH = sys.intern("HIGH")
+LOW = sys.intern("LOW")
+NORMAL = sys.intern("NORMAL")
+_CANON_FLAGS = {HIGH: HIGH, LOW: LOW, NORMAL: NORMAL}
+
 def _flag_of(agg: dict, key: str) -> str | None:
     item = agg.get(key)
     if not item:
         return None
     f = item.get("flag")
-    return f if isinstance(f, str) and f in ("HIGH", "LOW", "NORMAL") else None
+    # Unknown strings and non-strings both fall out as None, as before.
+    return _CANON_FLAGS.get(f) if isinstance(f, str) else None
+
+# The template predicates are the innermost hot path: normalize the nested
+# per-key dicts once per patient into a flat tuple, so every condition below
+# is a plain attribute test instead of repeated dict chasing.
+Flags = namedtuple("Flags", "tsh ft4 t4 fti t3 tpoab")
+
+def _flags(agg: dict) -> Flags:
+    return Flags(*(_flag_of(agg, k) for k in Flags._fields))
 
-def _any_high(agg, keys):
-    return any(_flag_of(agg, k) == "HIGH" for k in keys if k in agg)
+def _any_high(flags: Flags, keys):
+    return any(getattr(flags, k) == HIGH for k in keys)
 
-def _any_low(agg, keys):
-    return any(_flag_of(agg, k) == "LOW" for k in keys if k in agg)
+def _any_low(flags: Flags, keys):
+    return any(getattr(flags, k) == LOW for k in keys)
 
-def _all_normal_or_missing(agg, keys):
-    for k in keys:
-        f = _flag_of(agg, k)
-        if f is None:
-            continue
-        if f != "NORMAL":
-            return False
-    return True
+def _all_normal_or_missing(flags: Flags, keys):
+    return all(getattr(flags, k) in (None, NORMAL) for k in keys)
 
-def _discordant_patterns(agg) -> bool:
+def _discordant_patterns(flags: Flags) -> bool:
     """
         Detecting "Inconsistent/Illogical" Indicator Patterns:
 
@@ -48,21 +62,17 @@ def _discordant_patterns(agg) -> bool:
 
         - Only T3 is abnormal, while TSH and FT4/T4/FT1 are normal (e.g., due to medication, non-thyroid syndrome).
     """
-    tsh = _flag_of(agg, "tsh")
-    ft4 = _flag_of(agg, "ft4")
-    t4  = _flag_of(agg, "t4")
-    fti = _flag_of(agg, "fti")
-    t3  = _flag_of(agg, "t3")
+    tsh, ft4, t4, fti, t3 = flags.tsh, flags.ft4, flags.t4, flags.fti, flags.t3
 
     non_tsh = [ft4, t4, fti, t3]
-    if tsh == "NORMAL" and any(f in ("HIGH", "LOW") for f in non_tsh if f is not None):
+    if tsh == NORMAL and any(f in (HIGH, LOW) for f in non_tsh if f is not None):
         return True
-    if tsh == "LOW" and any(f == "LOW" for f in [ft4, t4, fti] if f is not None):
+    if tsh == LOW and any(f == LOW for f in [ft4, t4, fti] if f is not None):
         return True
-    if tsh == "HIGH" and any(f == "HIGH" for f in [ft4, t4, fti] if f is not None):
+    if tsh == HIGH and any(f == HIGH for f in [ft4, t4, fti] if f is not None):
         return True
     # isolated T3 abnormal
-    if t3 in ("HIGH", "LOW") and tsh == "NORMAL" and _all_normal_or_missing(agg, ["ft4", "t4", "fti"]):
+    if t3 in (HIGH, LOW) and tsh == NORMAL and _all_normal_or_missing(flags, ["ft4", "t4", "fti"]):
         return True
     return False
 
@@ -77,6 +87,13 @@ _MED_KEYWORDS = [
     "dopamine", "heparin", "biotin",
 ]
 
+# One compiled alternation (longest keyword first) walks the text in a single
+# pass instead of one substring scan per keyword; re's engine gives the
+# multi-pattern scan without a pyahocorasick dependency.
+_MED_KEYWORD_RE = re.compile(
+    "|".join(map(re.escape, sorted(_MED_KEYWORDS, key=len, reverse=True)))
+)
+
 def _collect_text_summary(task, idx) -> str | None:
     """
     Called only when the outer layer checks for permission; no fallback scan is performed internally.
@@ -95,24 +112,39 @@ def _collect_text_summary(task, idx) -> str | None:
 def _detect_med_keywords(text: str | None):
     if not text:
         return False, []
-    low = text.lower()
-    hits = sorted({kw for kw in _MED_KEYWORDS if kw in low})
+    # casefold once per patient; the keyword patterns are already lowercase
+    # so the single folded copy is the only allocation the scan needs.
+    hits = sorted(set(_MED_KEYWORD_RE.findall(text.casefold())))
     return (len(hits) > 0), hits
 
+# The keyword scan is pure in the patient text, so repeated solve() calls for
+# the same idx (re-evals, multi-seed sweeps) can replay the cached result.
+_MED_CACHE: dict[int, tuple[bool, list]] = {}
+
+def reset_med_cache():
+    """Drop cached medication-keyword scans (call when switching datasets)."""
+    _MED_CACHE.clear()
+
+def _detect_med_keywords_cached(idx, text: str | None):
+    hit = _MED_CACHE.get(idx)
+    if hit is None:
+        hit = _MED_CACHE[idx] = _detect_med_keywords(text)
+    return hit
+
 # =============== Template collection (all based on flag; med templates support ctx) ===============
-def _tpl_hyper_condition(agg, ctx=None):
-    return _flag_of(agg, "tsh") == "LOW" and _any_high(agg, ["ft4", "t4", "fti", "t3"])
+def _tpl_hyper_condition(flags, ctx=None):
+    return flags.tsh == LOW and _any_high(flags, ["ft4", "t4", "fti", "t3"])
 
-def _tpl_hypo_condition(agg, ctx=None):
-    return _flag_of(agg, "tsh") == "HIGH" and _any_low(agg, ["ft4", "t4", "fti"])
+def _tpl_hypo_condition(flags, ctx=None):
+    return flags.tsh == HIGH and _any_low(flags, ["ft4", "t4", "fti"])
 
-def _tpl_subclinical_condition(agg, ctx=None):
-    return (_flag_of(agg, "tsh") in ("HIGH", "LOW")) and _all_normal_or_missing(agg, ["ft4", "t4", "fti"])
+def _tpl_subclinical_condition(flags, ctx=None):
+    return (flags.tsh in (HIGH, LOW)) and _all_normal_or_missing(flags, ["ft4", "t4", "fti"])
 
-def _tpl_normal_condition(agg, ctx=None):
-    return (_flag_of(agg, "tsh") == "NORMAL") and _all_normal_or_missing(agg, ["ft4", "t4", "fti"])
+def _tpl_normal_condition(flags, ctx=None):
+    return (flags.tsh == NORMAL) and _all_normal_or_missing(flags, ["ft4", "t4", "fti"])
 
-def _tpl_med_or_interference_condition(agg, ctx=None):
+def _tpl_med_or_interference_condition(flags, ctx=None):
     """
     Triggering conditions:
 
@@ -121,7 +153,11 @@ def _tpl_med_or_interference_condition(agg, ctx=None):
     - Or, a "discordant pattern" exists (_discordant_patterns).
     """
     med_hit = bool(ctx and ctx.get("med_text_hit"))
-    return med_hit or _discordant_patterns(agg)
+    # solve() already ran the discordance scan once for ctx; reuse it and
+    # only recompute when a caller hands in a ctx without it.
+    if ctx is not None and "discordant" in ctx:
+        return med_hit or bool(ctx["discordant"])
+    return med_hit or _discordant_patterns(flags)
 
 TEMPLATES = [
     # Medication/interference templates have priority
@@ -173,6 +209,87 @@ TEMPLATES = [
 ]
 
 
+# Declarative condition expressions (one per TEMPLATES entry, same order),
+# compiled below into a single function at import time: per-sample matching
+# becomes one chain of inline tests with no closure dispatch or arity
+# probing, and the declarative list stays the single source of truth.
+_TEMPLATE_EXPRS = [
+    ("medication_or_assay_interference",
+     'med_hit or (bool(ctx["discordant"]) if (ctx and "discordant" in ctx)'
+     ' else _discordant_patterns(flags))'),
+    ("hyperthyroidism", 'tsh == "LOW" and _any_high(flags, ("ft4", "t4", "fti", "t3"))'),
+    ("hypothyroidism", 'tsh == "HIGH" and _any_low(flags, ("ft4", "t4", "fti"))'),
+    ("subclinical", 'tsh in ("HIGH", "LOW") and peripherals_normal'),
+    ("normal", 'tsh == "NORMAL" and peripherals_normal'),
+]
+assert [n for n, _ in _TEMPLATE_EXPRS] == [t["name"] for t in TEMPLATES]
+
+
+def _compile_template_hits():
+    lines = [
+        "def _template_hits(flags, ctx):",
+        "    med_hit = bool(ctx and ctx.get('med_text_hit'))",
+        "    tsh = flags.tsh",
+        "    peripherals_normal = _all_normal_or_missing(flags, ('ft4', 't4', 'fti'))",
+        "    return (",
+    ]
+    lines += [f"        bool({expr})," for _, expr in _TEMPLATE_EXPRS]
+    lines.append("    )")
+    ns = {}
+    exec("\n".join(lines), globals(), ns)
+    return ns["_template_hits"]
+
+
+_template_hits = _compile_template_hits()
+
+
+# =============== Batched matching over many samples ===============
+# For bulk evaluation the per-sample Python dispatch still dominates, so the
+# flags can be encoded once into a structure-of-arrays int8 matrix and every
+# template condition becomes a whole-batch boolean expression in C.
+# Codes: 0 = missing, 1 = LOW, 2 = NORMAL, 3 = HIGH.
+_FLAG_CODES = {None: 0, "LOW": 1, "NORMAL": 2, "HIGH": 3}
+_BATCH_KEYS = ("tsh", "ft4", "t4", "fti", "t3")
+
+
+def encode_flags_batch(aggs):
+    """Encode an iterable of aggregates into an (N, 5) int8 matrix in
+    _BATCH_KEYS order, plus nothing else — med_hit comes from ctx."""
+    return np.array(
+        [[_FLAG_CODES[_flag_of(agg, k)] for k in _BATCH_KEYS] for agg in aggs],
+        dtype=np.int8,
+    ).reshape(-1, len(_BATCH_KEYS))
+
+
+def match_flags_batch(flags, med_hit):
+    """Vectorized retrieve_template over an (N, 5) int8 flag matrix and an
+    (N,) bool med-hit vector: returns the index into TEMPLATES of the first
+    matching template per sample (-1 when none matches)."""
+    tsh, ft4, t4, fti, t3 = (flags[:, i] for i in range(len(_BATCH_KEYS)))
+    ft4_ab, t4_ab, fti_ab = ((a == 1) | (a == 3) for a in (ft4, t4, fti))
+    t3_ab = (t3 == 1) | (t3 == 3)
+    periph_normal = ~(ft4_ab | t4_ab | fti_ab)  # missing counts as normal
+
+    discordant = (
+        ((tsh == 2) & (ft4_ab | t4_ab | fti_ab | t3_ab))
+        | ((tsh == 1) & ((ft4 == 1) | (t4 == 1) | (fti == 1)))
+        | ((tsh == 3) & ((ft4 == 3) | (t4 == 3) | (fti == 3)))
+        | (t3_ab & (tsh == 2) & periph_normal)
+    )
+    conds = [
+        np.asarray(med_hit, dtype=bool) | discordant,
+        (tsh == 1) & ((ft4 == 3) | (t4 == 3) | (fti == 3) | (t3 == 3)),
+        (tsh == 3) & ((ft4 == 1) | (t4 == 1) | (fti == 1)),
+        ((tsh == 1) | (tsh == 3)) & periph_normal,
+        (tsh == 2) & periph_normal,
+    ]
+    out = np.full(flags.shape[0], -1, dtype=np.int8)
+    # assign in reverse so earlier templates keep first-match priority
+    for i in range(len(conds) - 1, -1, -1):
+        out[conds[i]] = i
+    return out
+
+
 # =============== Template calling and intermediate information recording ===============
 def _truncate(text: str, limit: int = 2000) -> str:
     if not isinstance(text, str):
@@ -181,32 +298,35 @@ def _truncate(text: str, limit: int = 2000) -> str:
         return text
     return text[:limit] + f"\n...[truncated {len(text)-limit} chars]"
 
-def _call_condition(tpl, agg, ctx):
-    try:
-        # It is uniformly called using (agg, ctx); if the template implementation does not use ctx, it will not have any impact.
-        return bool(tpl["condition"](agg, ctx))
-    except TypeError:
-        # Backward compatible single-parameter implementation
-        try:
-            return bool(tpl["condition"](agg))
-        except Exception:
-            return False
-    except Exception:
-        return False
-
-def retrieve_template(agg, ctx):
-    for tpl in TEMPLATES:
-        if _call_condition(tpl, agg, ctx):
-            return tpl
-    return None
-
-def evaluate_templates(agg, ctx):
+def retrieve_template(flags, ctx):
+    """
+    Single pass over TEMPLATES: each condition runs exactly once, yielding
+    both the first matched template (or None) and the per-template hit list
+    that used to need a second full evaluate_templates scan.
+
+    The condition chain itself is generated from _TEMPLATE_EXPRS and
+    compiled once at import (_template_hits), so shared work (TSH flag,
+    peripheral-normal test) is computed once per sample with no closure
+    dispatch or arity probing.
+    """
+    hits = _template_hits(flags, ctx)
+    results = [
+        {"name": tpl["name"], "trigger": tpl["trigger"], "matched": ok}
+        for tpl, ok in zip(TEMPLATES, hits)
+    ]
+    matched = next((tpl for tpl, ok in zip(TEMPLATES, hits) if ok), None)
+    return matched, results
+
+def evaluate_templates(flags, ctx):
     """
     Returns the hit status of each template, facilitating the writing of intermediate information.
     """
     results = []
     for tpl in TEMPLATES:
-        ok = _call_condition(tpl, agg, ctx)
+        # Condition contract: every template takes (flags, ctx); the ones
+        # that ignore ctx just never read it. Calling directly avoids the
+        # old exception-driven arity probing.
+        ok = bool(tpl["condition"](flags, ctx))
         results.append({
             "name": tpl["name"],
             "trigger": tpl["trigger"],
@@ -258,7 +378,7 @@ def fallback_llm(summary_obj, backend, temperature=0.2):
         "Please follow the format below:\n"
         "[Reasoning] ...\n[Conclusion] ...\n[Label] 1 or 0"
     )
-    out = completion(prompt, model=backend, temperature=temperature, stop=None)
+    out = cached_completion(prompt, model=backend, temperature=temperature, stop=None)
     return out.strip()
 
 
@@ -276,20 +396,21 @@ def solve(args, task, idx, to_print=True):
     # 0) Distill
     summary_obj = task.get_structured_summary(idx)
     agg = summary_obj["aggregate"]
+    flags = _flags(agg)  # normalized once; all template predicates read this
 
     # Enables text-based medication clues only if args.use_text is True.
     use_text_enabled = bool(getattr(args, "use_text", False))
 
     if use_text_enabled:
         text_summary = _collect_text_summary(task, idx)
-        med_text_hit, med_keywords = _detect_med_keywords(text_summary)
+        med_text_hit, med_keywords = _detect_med_keywords_cached(idx, text_summary)
         text_excerpt = _truncate(text_summary, 800) if text_summary else None
     else:
         text_summary = None
         med_text_hit, med_keywords = False, []
         text_excerpt = None
 
-    discordant = _discordant_patterns(agg)
+    discordant = _discordant_patterns(flags)
 
     # Optional: flag_block digest (to avoid truncating excessively large JSON data)
     try:
@@ -322,8 +443,7 @@ def solve(args, task, idx, to_print=True):
     steps.append(step0)
 
     # 1) Retrieve 模板评估（带 ctx）
-    tmpl_eval = evaluate_templates(agg, ctx)
-    template = retrieve_template(agg, ctx)
+    template, tmpl_eval = retrieve_template(flags, ctx)
 
     step1 = {
         "stage": "retrieve",
@@ -1,12 +1,24 @@
 # -*- coding: utf-8 -*-
 # file: src/tot/methods/cot.py
 import re
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple
-from tot.models import completion
+from tot.methods.llm_cache import cached_completion
 
 # Matches "Final: 0/1"
 _FINAL = re.compile(r'\bfinal\s*[:：]?\s*([01])\b', re.IGNORECASE)
 
+# All static instructions live in the prefix so vendor prompt/KV caches can
+# reuse the shared-prefix attention states across patients; only the
+# patient-specific blocks vary at the tail.
+SYSTEM_PREFIX = (
+    "You are an experienced endocrinologist.\n"
+    "Task: Decide if the patient likely has a thyroid disease (1) or not (0).\n\n"
+    "Think step by step privately and DO NOT reveal your reasoning.\n"
+    "Output ONLY one line in the exact format:\n"
+    "Final: 1  (if disease)  OR  Final: 0 (if not)"
+)
+
 
 def build_cot_prompt(lab_block: str, text_summary: str | None = None) -> str:
     """
@@ -20,11 +32,7 @@ def build_cot_prompt(lab_block: str, text_summary: str | None = None) -> str:
         )
 
     return (
-        "You are an experienced endocrinologist.\n"
-        "Task: Decide if the patient likely has a thyroid disease (1) or not (0).\n\n"
-        "Think step by step privately and DO NOT reveal your reasoning.\n"
-        "Output ONLY one line in the exact format:\n"
-        "Final: 1  (if disease)  OR  Final: 0 (if not)\n\n"
+        f"{SYSTEM_PREFIX}\n\n"
         f"Patient lab data:\n{lab_block}\n"
         f"{text_part}"
         "Now provide ONLY the final line."
@@ -52,12 +60,30 @@ def solve_one_cot(
     """
     Given a complete prompt, sample n times to perform self-consistency.
     """
-    raws: List[str] = []
+    # The n samples are independent; fan them out like bfs.gpt does.
+    # sample_idx keeps the n self-consistency samples distinct in the cache.
+    if n_generate <= 1:
+        raws: List[str] = [cached_completion(prompt, model=model)]
+    else:
+        with ThreadPoolExecutor(max_workers=n_generate) as ex:
+            raws = list(ex.map(
+                lambda i: cached_completion(prompt, model=model, sample_idx=i),
+                range(n_generate)))
+
     labels: List[int] = []
-    for _ in range(n_generate):
-        out = completion(prompt, model=model)  # Note: Completion does not support temperature.
-        raws.append(out)
-        labels.append(_parse_final(out))
+    for out in raws:
+        # Fast path: a well-formed sample ends with "Final: 0/1" alone on
+        # the last line, so a string test replaces the two regex passes.
+        # The whole token after "Final:" must be exactly "0" or "1" — a
+        # last-character check would read "Final: 10" as 0 — and anything
+        # else falls through to _parse_final (whose loose \b([01])\b
+        # fallback can also grab stray digits).
+        tail = out.rstrip().rpartition("\n")[2].strip() if out else ""
+        token = tail[6:].strip() if tail.startswith("Final:") else ""
+        if token in ("0", "1"):
+            labels.append(int(token))
+        else:
+            labels.append(_parse_final(out))
 
     votes = [v for v in labels if v in (0, 1)]
     if not votes:
@@ -1,57 +1,73 @@
 # evaluate_utils.py
 from sklearn.metrics import classification_report
-import os, json, pandas as pd
+import csv, os, json
 import numpy as np
 from datetime import datetime
 
-def evaluate(y_true, y_pred, model_name="default_model",
-             buffer_path=None, method_name=None, metrics_path=None):
+def compute_report(y_true, y_pred):
     """
-    Print and save the classification report:
-
-    - Save a CSV file (with timestamps) under `results/`
-
-    - If `buffer_path` (i.e., the path to `*_predictions.json`) is provided, `*_metrics.json` will be automatically derived to store the metrics.
+    Pure metric computation: filter out -1 predictions and return the
+    classification report dict (or None when nothing survives filtering).
 
-    Alternatively, you can explicitly pass in `metrics_path`.
+    No filesystem side effects, so per-fold/per-epoch loops can call this
+    repeatedly and only persist the run they care about via save_report.
     """
     # --- START: Filter out entries with a value of -1.---
     print(f"开始评估... 接收到 {len(y_pred)} 个原始预测。")
     
-    # Using the NumPy method (recommended)
-    y_true_np = np.array(y_true)
-    y_pred_np = np.array(y_pred)
-    
+    # One typed conversion up front (this also coerces "1" to 1), then a
+    # single boolean mask — no intermediate untyped arrays or astype copies.
+    y_true_np = np.asarray(y_true, dtype=np.int64)
+    y_pred_np = np.asarray(y_pred, dtype=np.int64)
+
     mask = y_pred_np != -1
-    
-    y_true_filtered = y_true_np[mask]
-    y_pred_filtered = y_pred_np[mask]
-    
+
+    y_true_clean = y_true_np[mask]
+    y_pred_clean = y_pred_np[mask]
+
     # Check if there are any valid data points available for evaluation.
-    if len(y_pred_filtered) == 0:
+    if len(y_pred_clean) == 0:
         print("[Warning] After filtering, no effective predictions are available for evaluation.")
         return None # Or return an empty report.
 
-    num_filtered = len(y_pred) - len(y_pred_filtered)
+    num_filtered = len(y_pred_np) - len(y_pred_clean)
     if num_filtered > 0:
-        print(f"{num_filtered} unresolved predictions (value -1) have been ignored. The metric will be computed on {len(y_pred_filtered)} valid samples.")
+        print(f"{num_filtered} unresolved predictions (value -1) have been ignored. The metric will be computed on {len(y_pred_clean)} valid samples.")
     # --- END: Filtering ---
 
-    # Forced type conversion to int prevents the mixing of "1" and 1.
-    y_true_clean = y_true_filtered.astype(int)
-    y_pred_clean = y_pred_filtered.astype(int)
-
     # Evaluation using filtered and cleaned data
     report = classification_report(y_true_clean, y_pred_clean, target_names=["0", "1"], output_dict=True)
 
     print("=== Overall Evaluation ===")
     print(classification_report(y_true_clean, y_pred_clean, target_names=["0", "1"]))
 
+    return report
+
+
+def save_report(report, model_name="default_model",
+                buffer_path=None, method_name=None, metrics_path=None):
+    """
+    Persist a report from compute_report: a timestamped CSV under
+    `results/` and, when `buffer_path` or `metrics_path` is given, the
+    `*_metrics.json` summary. Returns (csv_path, metrics_path).
+    """
     os.makedirs("results", exist_ok=True)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     csv_name = f"{(model_name or 'model').replace('/', '_')}_{method_name or 'default'}_{timestamp}_classification_report.csv"
     csv_path = os.path.join("results", csv_name)
-    pd.DataFrame(report).transpose().to_csv(csv_path, encoding="utf-8", index=True)
+    # The report is a tiny fixed-shape table; write it directly instead of
+    # paying DataFrame construction for five rows (same layout as the old
+    # pd.DataFrame(report).transpose().to_csv, including the broadcast
+    # accuracy row).
+    metric_cols = ["precision", "recall", "f1-score", "support"]
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow([""] + metric_cols)
+        for key, val in report.items():
+            if isinstance(val, dict):
+                w.writerow([key] + [val.get(c, "") for c in metric_cols])
+            else:
+                w.writerow([key] + [val] * len(metric_cols))
     print(f"[Saved] CSV report -> {csv_path}")
 
     # Compile a concise summary for easy program reading.
@@ -89,4 +105,25 @@ def evaluate(y_true, y_pred, model_name="default_model",
             json.dump(summary, f, ensure_ascii=False, indent=2)
         print(f"[Saved] Metrics JSON -> {metrics_path}")
 
+    return csv_path, metrics_path
+
+
+def evaluate(y_true, y_pred, model_name="default_model",
+             buffer_path=None, method_name=None, metrics_path=None):
+    """
+    Print and save the classification report:
+
+    - Save a CSV file (with timestamps) under `results/`
+
+    - If `buffer_path` (i.e., the path to `*_predictions.json`) is provided, `*_metrics.json` will be automatically derived to store the metrics.
+
+    Alternatively, you can explicitly pass in `metrics_path`.
+    """
+    report = compute_report(y_true, y_pred)
+    if report is None:
+        return None
+    csv_path, metrics_path = save_report(
+        report, model_name=model_name, buffer_path=buffer_path,
+        method_name=method_name, metrics_path=metrics_path,
+    )
     return report, csv_path, metrics_path
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""Disk-backed prompt cache shared by the reasoning methods.
+
+Completions are keyed by blake2b(model | temperature | sample index | prompt)
+and persisted in sqlite, so reruns and cross-run replays of the same patient
+short-circuit the model call entirely. The sample index is part of the key on
+purpose: multi-sample (self-consistency) calls stay distinct samples instead
+of collapsing into one cached response.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+from tot.models import completion
+
+CACHE_PATH = Path(os.environ.get("TOT_LLM_CACHE", ".llm_cache.sqlite"))
+
+_cache_lock = threading.Lock()
+_cache_conn = None
+
+
+def _cache_db():
+    global _cache_conn
+    if _cache_conn is None:
+        _cache_conn = sqlite3.connect(str(CACHE_PATH), check_same_thread=False)
+        _cache_conn.execute("CREATE TABLE IF NOT EXISTS cache(h BLOB PRIMARY KEY, out TEXT)")
+        _cache_conn.commit()
+    return _cache_conn
+
+
+def _key(prompt, model, temperature, sample_idx) -> bytes:
+    # Near-duplicate prompts usually differ only in whitespace (template
+    # joins, trailing newlines), so the key hashes a whitespace-collapsed
+    # form and those variants share one cache entry.
+    norm = " ".join(prompt.split())
+    raw = f"{model}\x00{temperature}\x00{sample_idx}\x00{norm}".encode("utf-8")
+    return hashlib.blake2b(raw, digest_size=32).digest()
+
+
+def cached_completion(prompt: str, stop=None, model=None,
+                      temperature=0.6, sample_idx: int = 0) -> str:
+    """completion() with a byte-exact disk cache in front of it."""
+    h = _key(prompt, model, temperature, sample_idx)
+    with _cache_lock:
+        row = _cache_db().execute("SELECT out FROM cache WHERE h=?", (h,)).fetchone()
+    if row is not None:
+        return row[0]
+    out = completion(prompt, stop=stop, model=model, temperature=temperature)
+    with _cache_lock:
+        conn = _cache_db()
+        conn.execute("INSERT OR IGNORE INTO cache(h, out) VALUES (?, ?)", (h, out))
+        conn.commit()
+    return out
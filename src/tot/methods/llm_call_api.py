@@ -2,9 +2,36 @@
 # file: src/tot/methods/llm_call_api.py
 import os
 import requests
+from requests.adapters import HTTPAdapter, Retry
 from typing import Optional
 from openai import OpenAI
 
+# Pooled keep-alive session shared by the local and vapi branches; avoids a
+# fresh TCP/TLS handshake on every call.
+_SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64,
+                       max_retries=Retry(total=2, backoff_factor=0.2))
+_SESSION.mount("http://", _adapter)
+_SESSION.mount("https://", _adapter)
+
+# Optional HTTP/2 client: multiplexes concurrent calls over one connection
+# when httpx (with the h2 extra) is available; otherwise the pooled session
+# above is used.
+try:
+    import httpx
+    _HTTP = httpx.Client(
+        http2=True, timeout=120.0,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    )
+except Exception:
+    _HTTP = None
+
+
+def _post_json(url, payload, headers=None, timeout=120):
+    if _HTTP is not None:
+        return _HTTP.post(url, json=payload, headers=headers, timeout=timeout)
+    return _SESSION.post(url, json=payload, headers=headers, timeout=timeout)
+
 # ====== Three platform configurations ======
 
 # Your own server (vLLM)
@@ -46,11 +73,10 @@ def get_response(
             "temperature": temperature,
         }
         try:
-            r = requests.post(
-                # f"{LOCAL_BASE_URL}/chat/completions",
+            r = _post_json(
                 f"{LOCAL_BASE_URL}/chat/completions",
+                payload,
                 headers={"Content-Type": "application/json"},
-                json=payload,
                 timeout=120,
             )
             r.raise_for_status()
@@ -75,7 +101,7 @@ def get_response(
         }
 
         try:
-            r = requests.post(url, json=payload, headers=headers, timeout=120)
+            r = _post_json(url, payload, headers=headers, timeout=120)
             r.raise_for_status()
             data = r.json()
             return data["choices"][0]["message"]["content"]
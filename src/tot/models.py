@@ -1,11 +1,38 @@
 # -*- coding: utf-8 -*-
 # models.py - Supports a unified interface for local vLLM, Ollama, and remote Qwen/OpenAI.
 
-import json
 import requests
+from requests.adapters import HTTPAdapter, Retry
 
 PROVIDER = "local"  # Optional: "local" | "vapi" | "openai" | "ollama"
 
+# One pooled session for every backend call: keep-alive connections skip the
+# per-request TCP handshake to the (stable) endpoints.
+_SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64,
+                       max_retries=Retry(total=2, backoff_factor=0.2))
+_SESSION.mount("http://", _adapter)
+_SESSION.mount("https://", _adapter)
+
+# HTTP/2 multiplexing when httpx (and its h2 extra) is installed: a single
+# connection then carries many in-flight requests without TCP head-of-line
+# blocking, which matters once callers batch concurrent completions. Falls
+# back to the pooled keep-alive session above otherwise.
+try:
+    import httpx
+    _HTTP = httpx.Client(
+        http2=True, timeout=300.0,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    )
+except Exception:
+    _HTTP = None
+
+
+def _post_json(url, payload, timeout=300):
+    if _HTTP is not None:
+        return _HTTP.post(url, json=payload, timeout=timeout)
+    return _SESSION.post(url, json=payload, timeout=timeout)
+
 from tot.methods.llm_call_api import get_response as _remote_get_response
 
 # ========== Local vLLM mode ==========
@@ -27,7 +54,7 @@ def chat_completion_vllm(messages, model=None,
     # if messages is None:
     #     return ""
     try:
-        res = requests.post(VLLM_API_URL, json=payload, timeout=300)
+        res = _post_json(VLLM_API_URL, payload, timeout=300)
         res.raise_for_status()
         data = res.json()
         return data["choices"][0]["message"]["content"].strip()
@@ -86,16 +113,13 @@ OLLAMA_MODEL = "llama2:7b-chat"
 
 def completion_ollama(prompt: str, model=None):
     model_name = model or OLLAMA_MODEL
-    payload = {"model": model_name, "prompt": prompt}
+    # The caller only ever sees the joined full text, so ask Ollama for one
+    # JSON body instead of parsing a json.loads per streamed token chunk.
+    payload = {"model": model_name, "prompt": prompt, "stream": False}
     try:
-        res = requests.post(OLLAMA_API_URL, data=json.dumps(payload), stream=True)
+        res = _post_json(OLLAMA_API_URL, payload)
         if res.status_code == 200:
-            output_chunks = []
-            for line in res.iter_lines():
-                if line:
-                    line_data = json.loads(line.decode("utf-8"))
-                    output_chunks.append(line_data.get("response", ""))
-            return "".join(output_chunks).strip()
+            return res.json().get("response", "").strip()
         else:
             print(f"[Ollama] LLM error: Status code {res.status_code}")
             return "error"
@@ -115,30 +139,33 @@ def chat_completion_ollama(messages, model=None):
 
 
 # ========== Unified external interface ==========
-def completion(prompt: str, stop=None, model=None,
-               temperature=0.6, max_tokens=1024):
+# Provider dispatch tables: resolve the backend function once at import time
+# instead of re-running the string comparisons on every call. Unknown
+# providers fall through to Ollama, same as the old else branch.
+_COMPLETION_BY_PROVIDER = {
+    "local": completion_vllm,
+    "vapi": completion_remote,
+    "openai": completion_remote,
+}
+
+_CHAT_COMPLETION_BY_PROVIDER = {
+    "local": chat_completion_vllm,
+    "vapi": chat_completion_remote,
+    "openai": chat_completion_remote,
+}
 
-    if PROVIDER == "local":
-        return completion_vllm(prompt, model=model,
-                               temperature=temperature,
-                               max_tokens=max_tokens)
 
-    elif PROVIDER in ["vapi", "openai"]:
-        return completion_remote(prompt, model=model,
-                                 temperature=temperature,
-                                 max_tokens=max_tokens)
-
-    else:
+def completion(prompt: str, stop=None, model=None,
+               temperature=0.6, max_tokens=1024):
+    fn = _COMPLETION_BY_PROVIDER.get(PROVIDER)
+    if fn is None:
         return completion_ollama(prompt, model=model)
+    return fn(prompt, model=model,
+              temperature=temperature, max_tokens=max_tokens)
 
 
 def chat_completion(messages, model=None):
-
-    if PROVIDER == "local":
-        return chat_completion_vllm(messages, model=model)
-
-    elif PROVIDER in ["vapi", "openai"]:
-        return chat_completion_remote(messages, model=model)
-
-    else:
+    fn = _CHAT_COMPLETION_BY_PROVIDER.get(PROVIDER)
+    if fn is None:
         return chat_completion_ollama(messages, model=model)
+    return fn(messages, model=model)
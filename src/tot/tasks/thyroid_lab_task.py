@@ -1,26 +1,183 @@
+import functools
 import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 from tot.tasks.base import Task
 import re
 import math
 
+# Compiled once at import: these patterns run on every prompt wrap and every
+# parsed model output, so per-call re.compile/cache lookups add up.
+_RE_STEP = re.compile(r'(?<!\n)(Step\s*\d+:)')
+_RE_ARROW = re.compile(r'(->\s*(HIGH|LOW|NORMAL))(?=\S)', re.IGNORECASE)
+_RE_BLANK = re.compile(r'\n{3,}')
+_RE_01 = re.compile(r'\b([01])\b')
+_RE_NUM = re.compile(r'[^\d\.\-eE]')
+
+# Leading-character scores for value_outputs_unwrap: a dict probe on the
+# first character is far cheaper than the ^1\b / ^0\b regexes it replaces.
+_V_MAP = {'1': 1.0, '0': 0.0}
+
+# Core thyroid analytes, in the order the feature vector and summary text
+# report them. _KEY_IDX maps each onto its slot in the per-patient agg_vec.
+_KEY_ORDER = ('tsh', 'ft4', 't3', 't4', 'fti', 'tpoab')
+_KEY_IDX = {k: i for i, k in enumerate(_KEY_ORDER)}
+
+# Single-character sanitizer mappings merged into one translate table: stray
+# carriage returns become newlines and brackets/backticks are defused in a
+# single C-level pass instead of one .replace scan each.
+_SAN_TRANS = str.maketrans({'\r': '\n', '[': '(', ']': ')', '`': "'"})
+
+# Conservative probe for _sanitize_free_text: if none of the characters or
+# phrases any transform touches occur, the whole pipeline is a no-op and one
+# scan replaces four. Case-insensitive so it can only over-trigger.
+_SAN_PROBE = re.compile(r'[\r\[\]`]|Step\s*\d+:|->\s*(HIGH|LOW|NORMAL)', re.IGNORECASE)
+
+# ToT step prompts: the instruction text is constant, so build it once and
+# splice only the per-call pieces in with %-formatting.
+_PROMPT_STEP0 = (
+    "You are a clinical assistant reviewing multiple lab test results for the same patient.\n\n"
+    "%s\n\n"
+    "Step 1:\n"
+    "For each test session, determine for each lab item whether it is HIGH, LOW, or NORMAL.\n"
+    "Format strictly as one item per line.\n"
+    "Reply for each session block. Do not make diagnosis yet."
+)
+_PROMPT_STEP1 = (
+    "Step 1 Observations:\n"
+    "%s\n\n%s\n\n"
+    "Step 2:\n"
+    "State possible implications for abnormal values; if all normal, write 'No issue'."
+)
+_PROMPT_STEP2 = (
+    "Reasoning so far (Steps 1 & 2):\n"
+    "%s\n\n%s\n\n"
+    "Step 3:\n"
+    "Does this patient likely have thyroid disease?\n"
+    "Reply ONLY with 1 (yes) or 0 (no)."
+)
+
+# Canonical test-name mapping (see _normalize_test_name for the enumeration).
+_TEST_NAME_MAP = {
+    "thyroid stimulating hormone": "tsh",
+    "thyroxine (t4), free": "ft4",
+    "triiodothyronine (t3)": "t3",
+    "calculated thyroxine (t4) index": "fti",
+    "thyroxine (t4)": "t4",
+    "thyroid peroxidase antibodies": "tpoab",
+}
+
+# The cohort has only a handful of distinct raw names repeated across
+# thousands of rows, so the lower/split/join normalization hits the cache
+# almost every call.
+@functools.lru_cache(maxsize=4096)
+def _normalize_test_name_cached(raw_name: str) -> str:
+    key = " ".join(raw_name.strip().lower().split())
+    return _TEST_NAME_MAP.get(key, raw_name)
+
 class ThyroidLabTask(Task):
     def __init__(self, use_text=False):
         super().__init__()
         data_path = os.path.join(os.path.dirname(__file__), "..", "data", "thyroid", "balanced_500_with_text_cleaned.csv")
         # data_path = os.path.join(os.path.dirname(__file__), "..", "data", "thyroid", "full_with_text_cleaned.csv")
-        self.df = pd.read_csv(data_path)
+        # Prefer the parquet sidecar written by the dataset-build scripts
+        # (columnar, no CSV quoting of the long text summaries); fall back to CSV.
+        # text_summary is by far the widest column; only pay its parse and
+        # memory cost when the caller actually wants the free-text notes.
+        load_cols = ['subject_id', 'charttime', 'test_name', 'test_value', 'value',
+                     'unit', 'ref_range_lower', 'ref_range_upper', 'flag', 'label']
+        if use_text:
+            load_cols.append('text_summary')
+        parquet_path = os.path.splitext(data_path)[0] + ".parquet"
+        if os.path.exists(parquet_path):
+            self.df = pd.read_parquet(parquet_path, columns=load_cols)
+        else:
+            # Arrow's multithreaded CSV reader when available; the default
+            # C engine otherwise.
+            try:
+                self.df = pd.read_csv(data_path, usecols=load_cols, engine="pyarrow")
+            except (ImportError, ValueError):
+                self.df = pd.read_csv(data_path, usecols=load_cols)
         self.use_text = use_text
 
+        # Parse every charttime once, vectorized over the whole table: a single
+        # C-level pass instead of a per-subject (and previously per-call)
+        # pd.to_datetime, plus the display string _fmt_time used to rebuild
+        # session by session.
+        self.df['_charttime_dt'] = pd.to_datetime(
+            self.df['charttime'], format="%d/%m/%Y %H:%M:%S", errors='coerce', cache=True
+        )
+        self.df['_charttime_str'] = (
+            self.df['_charttime_dt'].dt.strftime('%Y-%m-%d %H:%M').fillna('unknown-time')
+        )
+
+        # Vectorized numeric parse + HIGH/LOW/NORMAL decision over the whole
+        # table, replacing the per-row _parse_numeric/if-elif chain. The parse
+        # keeps _parse_numeric's semantics (strip non-numeric characters, then
+        # float), so values like "<0.01" still read as 0.01.
+        def _to_num(col):
+            return pd.to_numeric(
+                col.astype(str).str.replace(_RE_NUM, '', regex=True), errors='coerce'
+            )
+
+        tv = self.df['test_value']
+        tv_str = tv.astype(str)
+        tv_empty = tv.isna() | tv_str.eq('') | tv_str.str.lower().eq('nan')
+        self.df['_num_val'] = _to_num(tv_str.where(~tv_empty, self.df['value'].astype(str)))
+        self.df['_num_lo'] = _to_num(self.df['ref_range_lower'])
+        self.df['_num_hi'] = _to_num(self.df['ref_range_upper'])
+
+        flag_raw = self.df['flag'].astype(str).str.upper()
+        flag_fallback = np.where(
+            flag_raw.isin(("HIGH", "LOW", "NORMAL")), flag_raw, "UNKNOWN"
+        )
+        v = self.df['_num_val'].to_numpy()
+        lo = self.df['_num_lo'].to_numpy()
+        hi = self.df['_num_hi'].to_numpy()
+        have = ~np.isnan(v) & ~np.isnan(lo) & ~np.isnan(hi)
+        self.df['_flag_calc'] = np.select(
+            [have & (v < lo), have & (v > hi), have],
+            ["LOW", "HIGH", "NORMAL"],
+            default=flag_fallback,
+        ).tolist()
+
         # cache
         self.text_info_cache = {}
 
         # Grouping (each row = one lab record), patients are divided by subject_id.
-        self.subject_groups = self.df.groupby("subject_id", sort=False)
-        self.subject_ids = list(self.subject_groups.groups.keys())
+        # Materialize each patient's frame once: get_group re-enters the groupby
+        # machinery (hash lookup + frame construction) on every call, while a
+        # plain list index is O(1). Timestamps are parsed and the frame sorted
+        # here too, so session iteration never re-parses charttime.
+        grouped = self.df.groupby("subject_id", sort=False)
+        self.subject_ids = list(grouped.groups.keys())
+        # Struct-of-arrays view per patient: the builders only touch a handful
+        # of columns, so hold those as contiguous numpy arrays (plus the
+        # precomputed session runs) and keep pandas entirely off the hot path.
+        # The patient's text note (when loaded) is resolved here too, so
+        # get_input does a plain list index instead of dropna().unique().
+        self._subject_cols = []
+        self._text_by_idx = []
+        for _, g in grouped:
+            g = g.sort_values(by=['_charttime_dt', 'charttime'], ascending=[True, True]).reset_index(drop=True)
+            cols = {c: g[c].to_numpy() for c in self._ROW_COLS}
+            for c in ('_num_val', '_num_lo', '_num_hi', '_flag_calc'):
+                cols[c] = g[c].to_numpy()
+            # Sessions are contiguous runs after the sort; segment them once
+            # here so iteration never re-scans the frame per charttime.
+            cols['_sessions'] = self._segment_sessions(g)
+            self._subject_cols.append(cols)
+            if use_text:
+                texts = g['text_summary'].dropna().unique()
+                self._text_by_idx.append(str(texts[0]) if len(texts) > 0 else None)
+            else:
+                self._text_by_idx.append(None)
 
-        # label
-        self.answers = self.df.groupby("subject_id")["label"].first().astype(str).tolist()
+        # label — one int8 per patient, in the same first-appearance order as
+        # subject_ids (the old sorted groupby could misalign the two when the
+        # file is not pre-sorted by subject), and no str round-trip per check.
+        self.answers = grouped["label"].first().to_numpy(dtype=np.int8)
         self.max_num_examples = len(self.subject_ids)
 
         # ToT Steps (Backward Compatible)
@@ -28,6 +185,15 @@ class ThyroidLabTask(Task):
         self.stops = ["\n"] * self.steps
         self.value_cache = {}
 
+        # Per-idx memos: the block/distill outputs are deterministic in idx and
+        # ToT revisits the same patient many times (steps, candidates, votes).
+        self._lab_block_cache = {}
+        self._flag_block_cache = {}
+        self._distill_cache = {}
+        # Sanitized patient blocks, keyed by (idx, field): ToT sanitizes the
+        # same multi-KB x for every sampled candidate, while only y changes.
+        self._sanitized_x_cache = {}
+
     # ================= Security/General Tools =================
     def _safe(self, v):
         """Convert NaN/None to single quotes ('') to avoid mixing 'nan' text into the prompt."""
@@ -51,11 +217,14 @@ class ThyroidLabTask(Task):
     def _sanitize_free_text(self, s: str) -> str:
         if not s:
             return ""
-        s = s.replace("\r\n", "\n").replace("\r", "\n")
-        s = re.sub(r'(?<!\n)(Step\s*\d+:)', r'\n\1', s)  # Step before line break
-        s = re.sub(r'(->\s*(HIGH|LOW|NORMAL))(?=\S)', r'\1\n', s, flags=re.IGNORECASE)  # newline after arrow
-        s = s.replace('[', '(').replace(']', ')').replace('`', "'")  # Remove square brackets/backticks
-        s = re.sub(r'\n{3,}', '\n\n', s)  # Compress blank lines
+        if '\n\n\n' not in s and _SAN_PROBE.search(s) is None:
+            return s.strip()
+        if '\r' in s:
+            s = s.replace('\r\n', '\n')  # CRLF must collapse to one \n, so handle it before the table
+        s = s.translate(_SAN_TRANS)  # stray \r -> \n, remove square brackets/backticks
+        s = _RE_STEP.sub(r'\n\1', s)  # Step before line break
+        s = _RE_ARROW.sub(r'\1\n', s)  # newline after arrow
+        s = _RE_BLANK.sub('\n\n', s)  # Compress blank lines
         return s.strip()
 
     # ================= Name normalization & numerical analysis =================
@@ -73,18 +242,7 @@ Known enumeration (case-insensitive/space-insensitive):
         """
         if not raw_name:
             return ""
-        # Lightweight normalization: Remove leading and trailing spaces, unify lowercase, and compress extra spaces.
-        key = " ".join(str(raw_name).strip().lower().split())
-
-        mapping = {
-            "thyroid stimulating hormone": "tsh",
-            "thyroxine (t4), free": "ft4",
-            "triiodothyronine (t3)": "t3",
-            "calculated thyroxine (t4) index": "fti",
-            "thyroxine (t4)": "t4",
-            "thyroid peroxidase antibodies": "tpoab",
-        }
-        return mapping.get(key, raw_name)
+        return _normalize_test_name_cached(str(raw_name))
 
     def _parse_numeric(self, v):
         """
@@ -93,66 +251,105 @@ Known enumeration (case-insensitive/space-insensitive):
         if v is None:
             return None
         s = str(v).strip()
-        s = re.sub(r'[^\d\.\-eE]', '', s)
+        if not s:
+            return None
+        # Most values are already clean numerics: let C-level float() handle
+        # them and only fall back to the regex strip for decorated ones
+        # ("<0.01", "7,5", trailing units). Non-finite spellings ("nan",
+        # "inf") must keep going through the strip, which rejects them.
+        try:
+            f = float(s)
+            if math.isfinite(f):
+                return f
+        except ValueError:
+            pass
+        s = _RE_NUM.sub('', s)
         if not s:
             return None
         try:
             return float(s)
-        except Exception:
+        except ValueError:
             return None
 
-    def _row_value_text(self, r) -> str:
+    def _value_text(self, test_value, value) -> str:
         """
         Use `test_value` first; if it's empty, then fall back to `value`.
         """
-        tv = self._safe(r.get('test_value'))
+        tv = self._safe(test_value)
         if tv != "":
             return tv
-        return self._safe(r.get('value'))
+        return self._safe(value)
 
-    def _row_flag_text(self, r) -> str:
+    def _flag_text(self, flag) -> str:
         """
         Read the flags that are already present in the dataset (if any).
         """
-        f = self._safe(r.get('flag')).upper()
+        f = self._safe(flag).upper()
         if f in ("HIGH", "LOW", "NORMAL"):
             return f
         return ""
 
-    # ================= It will iterate through sessions in chronological order (one session per charttime). =================
-    def _iter_sessions(self, group_df: pd.DataFrame):
-        # Create a sortable time column
-        sdf = group_df.copy()
-        sdf['_charttime_dt'] = pd.to_datetime(sdf['charttime'], format="%d/%m/%Y %H:%M:%S", errors='coerce')
-        # First sort by time in ascending order, then by the original charttime character order to ensure stability.
-        sdf = sdf.sort_values(by=['_charttime_dt', 'charttime'], ascending=[True, True])
-
-        # Order-preserving deduplication charttime value
-        ordered_charttimes = list(dict.fromkeys(sdf['charttime'].tolist()))
+    # Columns every builder consumes, extracted once per patient as raw numpy
+    # arrays in __init__: iterrows would box a Series per row and pay a label
+    # lookup per field, which dominated the per-patient cost.
+    _ROW_COLS = ('test_name', 'test_value', 'value', 'unit',
+                 'ref_range_lower', 'ref_range_upper', 'flag')
 
-        for ct in ordered_charttimes:
-            sub = sdf[sdf['charttime'] == ct]
-            ts = self._fmt_time(ct)
-            yield ts, sub
+    # ================= It will iterate through sessions in chronological order (one session per charttime). =================
+    def _segment_sessions(self, group_df: pd.DataFrame):
+        """
+        Compute (ts, start, stop) runs for a frame pre-sorted by
+        (_charttime_dt, charttime): equal charttimes are contiguous, so one
+        linear pass replaces the per-charttime boolean mask (which scanned the
+        whole frame once per session).
+        """
+        ct_vals = group_df['charttime'].tolist()
+        ts_strs = group_df['_charttime_str'].tolist()
+        n = len(ct_vals)
+        segs = []
+        seen_nan_ids = set()
+        start = 0
+        for pos in range(1, n + 1):
+            if pos < n and ct_vals[pos] == ct_vals[pos - 1]:
+                continue
+            key = ct_vals[start]
+            if isinstance(key, float) and key != key:
+                # Missing charttime: the old equality mask matched no rows, so
+                # such rows produced an empty trailing session — one per
+                # distinct NaN object, mirroring dict.fromkeys identity dedup.
+                for i in range(start, pos):
+                    if id(ct_vals[i]) not in seen_nan_ids:
+                        seen_nan_ids.add(id(ct_vals[i]))
+                        segs.append(("unknown-time", pos, pos))
+            else:
+                segs.append((ts_strs[start], start, pos))
+            start = pos
+        return segs
 
     # ================== Construct the original block (by session) ==================
-    def _build_lab_block(self, subject_id: str, group_df: pd.DataFrame) -> str:
+    def _build_lab_block(self, subject_id: str, cols: dict) -> str:
         blocks = []
-        for ts, sub in self._iter_sessions(group_df):
-            header = f"### Test Session ({ts})"
-            lines = []
-            for _, r in sub.iterrows():
-                test_name = self._safe(r.get('test_name'))
-                test_value = self._row_value_text(r)
-                unit = self._safe(r.get('unit'))
-                lo = self._safe(r.get('ref_range_lower'))
-                hi = self._safe(r.get('ref_range_upper'))
+        names, tvs, vals = cols['test_name'], cols['test_value'], cols['value']
+        units, los, his = cols['unit'], cols['ref_range_lower'], cols['ref_range_upper']
+        for ts, start, stop in cols['_sessions']:
+            # One "".join over newline-prefixed parts: no intermediate lines
+            # list plus separate "\n".join pass, and the bound append skips an
+            # attribute lookup per row.
+            parts = [f"### Test Session ({ts})"]
+            pa = parts.append
+            for name, tv, val, unit, lo, hi in zip(
+                    names[start:stop], tvs[start:stop], vals[start:stop],
+                    units[start:stop], los[start:stop], his[start:stop]):
+                test_name = self._safe(name)
+                test_value = self._value_text(tv, val)
+                unit = self._safe(unit)
+                lo = self._safe(lo)
+                hi = self._safe(hi)
                 if unit:
-                    lines.append(f"- {test_name}: {test_value} {unit} (ref {lo} - {hi})")
+                    pa(f"\n- {test_name}: {test_value} {unit} (ref {lo} - {hi})")
                 else:
-                    lines.append(f"- {test_name}: {test_value} (ref {lo} - {hi})")
-            block_text = header + "\n" + "\n".join(lines)
-            blocks.append(block_text)
+                    pa(f"\n- {test_name}: {test_value} (ref {lo} - {hi})")
+            blocks.append("".join(parts))
 
         preface = (
             f"Patient ID: {subject_id}\n"
@@ -162,34 +359,19 @@ Known enumeration (case-insensitive/space-insensitive):
         return self._sanitize_free_text(lab_block)
 
     # ================== Flag Block Construction (Programmatic judgment, backtracking the flag column) ==================
-    def _build_flag_block(self, subject_id: str, group_df: pd.DataFrame) -> str:
+    def _build_flag_block(self, subject_id: str, cols: dict) -> str:
         blocks = []
-        for ts, sub in self._iter_sessions(group_df):
-            lines = []
-            for _, r in sub.iterrows():
-                test_name_raw = self._safe(r.get('test_name'))
-                val_text = self._row_value_text(r)
-                lo = self._safe(r.get('ref_range_lower'))
-                hi = self._safe(r.get('ref_range_upper'))
-
-                v = self._parse_numeric(val_text)
-                vlo = self._parse_numeric(lo)
-                vhi = self._parse_numeric(hi)
-
-                # Priority calculation; if calculation fails, fall back to the data's built-in flag.
-                if v is not None and vlo is not None and vhi is not None:
-                    if v < vlo:
-                        flag_calc = "LOW"
-                    elif v > vhi:
-                        flag_calc = "HIGH"
-                    else:
-                        flag_calc = "NORMAL"
-                else:
-                    flag_calc = self._row_flag_text(r) or "UNKNOWN"
-
-                lines.append(f"{test_name_raw}: {flag_calc}")
-            block_text = f"### Session ({ts})\n" + "\n".join(lines)
-            blocks.append(block_text)
+        names, flags = cols['test_name'], cols['_flag_calc']
+        for ts, start, stop in cols['_sessions']:
+            # Flags were decided vectorized at load (computed from the parsed
+            # value against the reference range, falling back to the dataset's
+            # own flag column, else UNKNOWN).
+            parts = [f"### Session ({ts})"]
+            parts.extend(
+                f"\n{self._safe(name)}: {flag_calc}"
+                for name, flag_calc in zip(names[start:stop], flags[start:stop])
+            )
+            blocks.append("".join(parts))
 
         preface = (
             f"Patient ID: {subject_id}\n"
@@ -203,8 +385,10 @@ Known enumeration (case-insensitive/space-insensitive):
         Returning a flag_block (program-defined) is used to prevent LLM from performing numerical inference.
         """
         subject_id = self.subject_ids[idx]
-        group = self.subject_groups.get_group(subject_id)
-        flag_block = self._build_flag_block(subject_id, group)
+        flag_block = self._flag_block_cache.get(idx)
+        if flag_block is None:
+            flag_block = self._build_flag_block(subject_id, self._subject_cols[idx])
+            self._flag_block_cache[idx] = flag_block
         return {"flag_block": flag_block, "idx": idx, "subject_id": subject_id}
 
     # ================== Problem Distiller ==================
@@ -221,37 +405,42 @@ Known enumeration (case-insensitive/space-insensitive):
             'abnormal_tokens': [...]
         }
         """
+        cached = self._distill_cache.get(idx)
+        if cached is not None:
+            return cached
+
         subject_id = self.subject_ids[idx]
-        group = self.subject_groups.get_group(subject_id)
+        cols = self._subject_cols[idx]
+        names, tvs, vals = cols['test_name'], cols['test_value'], cols['value']
+        nums, nlos, nhis = cols['_num_val'], cols['_num_lo'], cols['_num_hi']
+        flags_arr = cols['_flag_calc']
 
         sessions = []
         agg_map = {}  # Latest value
         abnormal_tokens = []
+        # Latest value per core analyte, filled in the main loop so
+        # get_lab_feature_vector reads a slot instead of chaining dict gets.
+        # A plain list rather than a float array: a parsed-but-empty latest
+        # value stays None, matching the old agg_map lookup exactly.
+        agg_vec = [math.nan] * len(_KEY_ORDER)
 
-        for ts, sub in self._iter_sessions(group):
+        for ts, start, stop in cols['_sessions']:
             lab_dict = {}
             session_abnormals = []
 
-            for _, r in sub.iterrows():
-                raw_name = self._safe(r.get('test_name'))
+            for name, tv, val, v, vlo, vhi, flag in zip(
+                    names[start:stop], tvs[start:stop], vals[start:stop],
+                    nums[start:stop], nlos[start:stop], nhis[start:stop],
+                    flags_arr[start:stop]):
+                raw_name = self._safe(name)
                 norm_name = self._normalize_test_name(raw_name)
-                val_text = self._row_value_text(r)
-                lo_raw = self._safe(r.get('ref_range_lower'))
-                hi_raw = self._safe(r.get('ref_range_upper'))
-
-                v = self._parse_numeric(val_text)
-                vlo = self._parse_numeric(lo_raw)
-                vhi = self._parse_numeric(hi_raw)
-
-                if v is not None and vlo is not None and vhi is not None:
-                    if v < vlo:
-                        flag = "LOW"
-                    elif v > vhi:
-                        flag = "HIGH"
-                    else:
-                        flag = "NORMAL"
-                else:
-                    flag = self._row_flag_text(r) or "UNKNOWN"
+                val_text = self._value_text(tv, val)
+
+                # Precomputed at load; NaN means the parse failed -> None,
+                # matching the old _parse_numeric contract.
+                v = float(v) if v == v else None
+                vlo = float(vlo) if vlo == vlo else None
+                vhi = float(vhi) if vhi == vhi else None
 
                 lab_dict[norm_name] = {
                     "raw_name": raw_name,
@@ -263,6 +452,9 @@ Known enumeration (case-insensitive/space-insensitive):
                 }
                 # The aggregation retains the latest version (because it has been sorted in ascending order of time).
                 agg_map[norm_name] = lab_dict[norm_name]
+                ki = _KEY_IDX.get(norm_name)
+                if ki is not None:
+                    agg_vec[ki] = v
                 if flag in ("HIGH", "LOW"):
                     session_abnormals.append(f"{norm_name}:{flag}")
 
@@ -275,7 +467,7 @@ Known enumeration (case-insensitive/space-insensitive):
 
         # Generate summary text
         summary_segments = []
-        for key in ("tsh", "ft4", "t3", "t4", "fti", "tpoab"):  # Add fti / tpoab
+        for key in _KEY_ORDER:  # Add fti / tpoab
             if agg_map.get(key):
                 tv = agg_map[key]["value"]
                 tf = agg_map[key]["flag"]
@@ -284,61 +476,75 @@ Known enumeration (case-insensitive/space-insensitive):
             summary_segments.append("No core thyroid hormones parsed")
         summary_text = " | ".join(summary_segments)
 
-        return {
+        result = {
             "subject_id": subject_id,
             "sessions": sessions,
             "aggregate": agg_map,
             "summary_text": summary_text,
-            "abnormal_tokens": abnormal_tokens
+            "abnormal_tokens": abnormal_tokens,
+            "agg_vec": agg_vec,
+            "n_abnormal_total": len(abnormal_tokens)
         }
+        self._distill_cache[idx] = result
+        return result
 
     def get_structured_summary(self, idx):
         return self.distill_problem(idx)
 
+    def prewarm_all(self, max_workers=None):
+        """
+        Distill every patient up front so later get_structured_summary /
+        get_lab_feature_vector calls are plain cache hits. The patients are
+        independent, so the work fans out over a thread pool (the per-patient
+        loop runs over numpy arrays and releases the GIL often enough for
+        this to help on large cohorts); results land in _distill_cache via
+        distill_problem's own memoization.
+        """
+        n = len(self)
+        if n == 0:
+            return
+        if max_workers is None:
+            max_workers = min(32, os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=min(max_workers, n)) as ex:
+            list(ex.map(self.distill_problem, range(n)))
+
     # Optional: Vectorized features
     def get_lab_feature_vector(self, idx):
         summary = self.get_structured_summary(idx)
-        agg = summary["aggregate"]
-        def val_or_nan(key):
-            return agg.get(key, {}).get("value", math.nan)
-        return {
-            "tsh": val_or_nan("tsh"),
-            "ft4": val_or_nan("ft4"),
-            "t3": val_or_nan("t3"),
-            "t4": val_or_nan("t4"),
-            "fti": val_or_nan("fti"),
-            "tpoab": val_or_nan("tpoab"),
-            "n_sessions": len(summary["sessions"]),
-            "n_abnormal": sum(len(s["abnormal_flags"]) for s in summary["sessions"])
-        }
+        features = dict(zip(_KEY_ORDER, summary["agg_vec"]))
+        features["n_sessions"] = len(summary["sessions"])
+        features["n_abnormal"] = summary["n_abnormal_total"]
+        return features
 
     # ================== Existing interface (maintaining compatibility) ==================
     def __len__(self):
         return len(self.subject_ids)
 
     def get_input(self, idx):
-        subject_id = self.subject_ids[idx]
-        group = self.subject_groups.get_group(subject_id)
+        lab_block = self._lab_block_cache.get(idx)
+        if lab_block is None:
+            subject_id = self.subject_ids[idx]
 
-        if self.use_text:
-            text_column = group["text_summary"].dropna().unique()
-            if len(text_column) > 0:
-                self.text_info_cache[idx] = str(text_column[0])
+            if self.use_text:
+                text_summary = self._text_by_idx[idx]
+                if text_summary is not None:
+                    self.text_info_cache[idx] = text_summary
 
-        lab_block = self._build_lab_block(subject_id, group)
+            lab_block = self._build_lab_block(subject_id, self._subject_cols[idx])
+            self._lab_block_cache[idx] = lab_block
         return {"lab_block": lab_block, "idx": idx}
 
     def test_output(self, idx, output):
-        match = re.search(r'\b([01])\b', output)
+        match = _RE_01.search(output)
         if match:
-            predicted = match.group(1)
-            return str(self.answers[idx]).strip() == predicted
+            # plain bool: the checkpoint JSON writer can't take numpy's
+            return bool(int(match.group(1)) == self.answers[idx])
         else:
             print(f"[Warning] Unable to extract 0/1 from the output：{output}")
             return False
 
     def format_output(self, output):
-        match = re.search(r'\b([01])\b', output)
+        match = _RE_01.search(output)
         if match:
             predicted = match.group(1)
             return int(predicted)
@@ -346,11 +552,31 @@ Known enumeration (case-insensitive/space-insensitive):
             print(f"[Warning] Unable to extract 0/1 from the output：{output}")
             return -1
 
+    def _sanitized_block(self, x: dict) -> str:
+        """Sanitize the patient block of an input dict, memoized per idx."""
+        idx = x.get("idx", None)
+        for field in ("lab_block", "flag_block", "summary_text"):
+            raw = x.get(field, "")
+            if raw:
+                break
+        else:
+            return ""
+        key = (idx, field)
+        if idx is not None:
+            cached = self._sanitized_x_cache.get(key)
+            if cached is not None:
+                return cached
+        s = self._sanitize_free_text(raw)
+        if idx is not None:
+            self._sanitized_x_cache[key] = s
+        return s
+
     # ================== Value Prompt ==================
     def value_prompt_wrap(self, x, y):
         if isinstance(x, dict):
-            x = x.get("lab_block", "") or x.get("flag_block", "") or x.get("summary_text", "")
-        x = self._sanitize_free_text(x)
+            x = self._sanitized_block(x)
+        else:
+            x = self._sanitize_free_text(x)
         y = self._sanitize_free_text(y)
         return (
             "You are a senior endocrinologist evaluating a junior doctor's clinical reasoning.\n\n"
@@ -362,55 +588,42 @@ Known enumeration (case-insensitive/space-insensitive):
 
     def value_outputs_unwrap(self, x, y, value_outputs):
         values = []
+        ap = values.append
         for output in value_outputs:
             output = output.strip().lower()
-            if re.match(r'^1\b', output):
-                values.append(1.0)
-            elif re.match(r'^0\b', output):
-                values.append(0.0)
-            else:
-                try:
-                    values.append(float(output))
-                except Exception:
-                    values.append(0.0)
+            if output:
+                score = _V_MAP.get(output[0])
+                # First-char lookup with a manual \b check (next char must not
+                # be a word character) replaces the two regex matches the old
+                # ^1\b / ^0\b patterns ran per candidate output.
+                if score is not None and (
+                        len(output) == 1
+                        or not (output[1].isalnum() or output[1] == '_')):
+                    ap(score)
+                    continue
+            try:
+                ap(float(output))
+            except Exception:
+                ap(0.0)
         return values
 
     # ================== ToT Prompt ==================
     def get_prompt(self, x, step, y=None):
         if isinstance(x, dict):
-            lab_block = x.get("lab_block", "") or x.get("flag_block", "") or x.get("summary_text", "")
+            lab_block = self._sanitized_block(x)
             idx = x.get("idx", None)
         else:
-            lab_block = x
+            lab_block = self._sanitize_free_text(x)
             idx = None
-        lab_block = self._sanitize_free_text(lab_block)
         if y is not None:
             y = self._sanitize_free_text(y)
 
         if step == 0:
-            return (
-                "You are a clinical assistant reviewing multiple lab test results for the same patient.\n\n"
-                f"{lab_block}\n\n"
-                "Step 1:\n"
-                "For each test session, determine for each lab item whether it is HIGH, LOW, or NORMAL.\n"
-                "Format strictly as one item per line.\n"
-                "Reply for each session block. Do not make diagnosis yet."
-            )
+            return _PROMPT_STEP0 % lab_block
         elif step == 1:
-            return (
-                "Step 1 Observations:\n"
-                f"{y}\n\n{lab_block}\n\n"
-                "Step 2:\n"
-                "State possible implications for abnormal values; if all normal, write 'No issue'."
-            )
+            return _PROMPT_STEP1 % (y, lab_block)
         elif step == 2:
-            return (
-                "Reasoning so far (Steps 1 & 2):\n"
-                f"{y}\n\n{lab_block}\n\n"
-                "Step 3:\n"
-                "Does this patient likely have thyroid disease?\n"
-                "Reply ONLY with 1 (yes) or 0 (no)."
-            )
+            return _PROMPT_STEP2 % (y, lab_block)
         else:
             raise ValueError("Invalid step")
 